@@ -57,40 +57,35 @@ known_model_strings = ['roms', 'selfe', 'adcirc', 'ncom', 'hycom', 'fvcom', 'pom
 
 # <codecell>
 
-from owslib import fes
+from utilities import query_plan
 
-model_name_filters = []
-for model in known_model_strings:
-    title_filter   = fes.PropertyIsLike(propertyname='apiso:Title',   literal='*%s*' % model, wildCard='*')
-    subject_filter = fes.PropertyIsLike(propertyname='apiso:Subject', literal='*%s*' % model, wildCard='*')
-    model_name_filters.append(fes.Or([title_filter, subject_filter]))
+# All the model strings are OR'ed into a single query per catalog and the
+# records are split by model client side.  The plan shows the cheapest
+# element set that still has the subjects and the references.
+query_plan('urls', split=True)
 
 # <markdowncell>
 
-# #### Query each CSW catalog for revery model_name_filter constructed above
+# #### Query each CSW catalog once for all the model strings
 
 # <codecell>
 
 from owslib.csw import CatalogueServiceWeb
+from utilities import survey_models, ReferenceTable
 
-model_results = []
+# Duplicated references are dropped as they arrive.
+references = ReferenceTable()
 
-for x in range(len(model_name_filters)):
-    model_name          = known_model_strings[x]
-    single_model_filter = model_name_filters[x]
-    for url in known_csw_servers:
-        try:
-            csw = CatalogueServiceWeb(url, timeout=20)
-            csw.getrecords2(constraints=[single_model_filter], maxrecords=1000, esn='full')
-            for record, item in csw.records.items():
-                for d in item.references:
-                    result = dict(model=model_name,
-                                  scheme=d['scheme'],
-                                  url=d['url'],
-                                  server=url)
-                    model_results.append(result)
-        except BaseException as e:
-            print "- FAILED: %s - %s" % (url, e.msg)
+for url in known_csw_servers:
+    try:
+        csw = CatalogueServiceWeb(url, timeout=20)
+        found = survey_models(csw, known_model_strings, need='urls')
+        references.extend((model_name, d['scheme'], d['url'], url)
+                          for model_name, records in found.items()
+                          for item in records
+                          for d in item.references)
+    except BaseException as e:
+        print "- FAILED: %s - %s" % (url, e.msg)
 
 # <markdowncell>
 
@@ -109,8 +104,7 @@ pd.set_option('display.max_rows', 50)
 
 from IPython.display import HTML
 
-df = pd.DataFrame(model_results)
-df = df.drop_duplicates()
+df = references.frame()
 
 # <markdowncell>
 
@@ -123,7 +117,7 @@ df = df.drop_duplicates()
 
 # <codecell>
 
-total_services = pd.DataFrame(df.groupby("scheme").size(), columns=("Number of services",))
+total_services = pd.DataFrame(references.counts("scheme"), columns=("Number of services",))
 #HTML(total_services.to_html())
 total_services.sort('Number of services', ascending=False).plot(kind="barh", figsize=(10,8,))
 
@@ -139,12 +133,12 @@ total_services.sort('Number of services', ascending=False).plot(kind="barh", fig
 # <codecell>
 
 from utilities import normalize_service_urn
-normalized_urns = df.copy(deep=True)
-normalized_urns["scheme"] = normalized_urns["scheme"].map(lambda x: normalize_service_urn(x))
+# The URNs are normalized once per distinct scheme, not once per reference.
+normalized_urns = dict(scheme=normalize_service_urn)
 
 # <codecell>
 
-normalized_urns_summary = pd.DataFrame(normalized_urns.groupby("scheme").size(), columns=("Number of services",))
+normalized_urns_summary = pd.DataFrame(references.counts("scheme", normalize=normalized_urns), columns=("Number of services",))
 normalized_urns_summary.sort('Number of services', ascending=False).plot(kind="barh", figsize=(10,6,))
 
 # <markdowncell>
@@ -157,9 +151,8 @@ normalized_urns_summary.sort('Number of services', ascending=False).plot(kind="b
 
 import math
 
-model_service_summary = pd.DataFrame(normalized_urns.groupby(["model", "scheme"], sort=True).size(), columns=("Number of services",))
-#HTML(model_service_summary.to_html())
-model_service_plotter = model_service_summary.unstack("model")
+model_service_plotter = references.counts("scheme", "model", normalize=normalized_urns)
+#HTML(model_service_plotter.to_html())
 model_service_plot = model_service_plotter.plot(kind='barh', figsize=(10,8,), sharey=True)
 
 # <markdowncell>
@@ -168,9 +161,8 @@ model_service_plot = model_service_plotter.plot(kind='barh', figsize=(10,8,), sh
 
 # <codecell>
 
-records_per_csw = pd.DataFrame(normalized_urns.groupby(["model", "server"]).size(), columns=("Number of services",))
-#HTML(records_per_csw.to_html())
-model_csw_plotter = records_per_csw.unstack("model")
+model_csw_plotter = references.counts("server", "model", normalize=normalized_urns)
+#HTML(model_csw_plotter.to_html())
 model_csw_plot = model_csw_plotter.plot(kind='barh', figsize=(10,8,), sharey=True)
 
 # <markdowncell>
@@ -179,8 +171,7 @@ model_csw_plot = model_csw_plotter.plot(kind='barh', figsize=(10,8,), sharey=Tru
 
 # <codecell>
 
-records_per_csw = pd.DataFrame(normalized_urns.groupby(["scheme", "server"]).size(), columns=("Number of services",))
-#HTML(records_per_csw.to_html())
-model_csw_plotter = records_per_csw.unstack("server")
+model_csw_plotter = references.counts("scheme", "server", normalize=normalized_urns)
+#HTML(model_csw_plotter.to_html())
 model_csw_plot = model_csw_plotter.plot(kind='barh', subplots=True, figsize=(12,30,), sharey=True)
 
@@ -0,0 +1,124 @@
+"""
+Benchmark the `ReferenceTable` accumulator against the list of dicts +
+`drop_duplicates` + groupby/unstack passes it replaces, on a synthetic
+workload shaped like the model-string survey.
+
+    python benchmark_references.py [number of references]
+"""
+
+import sys
+import time
+import random
+
+import pandas as pd
+
+from utilities import ReferenceTable, normalize_service_urn
+
+try:
+    import tracemalloc
+except ImportError:  # py2k
+    tracemalloc = None
+
+
+models = ['roms', 'selfe', 'adcirc', 'ncom', 'hycom', 'fvcom', 'pom',
+          'wrams', 'wrf']
+servers = ['http://csw%d.example.com/csw' % k for k in range(10)]
+schemes = (['urn:x-esri:specification:ServiceType:%s:url' % service
+            for service in ['odp', 'OPeNDAP', 'sos', 'wms', 'wcs', 'WWW',
+                            'download', 'ArcIMS']] +
+           ['OGC:%s' % service for service in ['WMS', 'WCS', 'SOS', 'WFS']] +
+           ['http://www.opengis.net/def/serviceType/ogc/%s' % service
+            for service in ['wms', 'wcs', 'sos']] +
+           ['%s:url' % service for service in ['odp', 'wms', 'sos']])
+
+
+def references(n, seed=42):
+    """`n` (model, scheme, url, server) tuples drawn from `2n/3` distinct
+    ones, like the same record returned for several pages/models."""
+    rng = random.Random(seed)
+    unique = [(rng.choice(models), rng.choice(schemes),
+               'http://data%d.example.com/thredds/dodsC/model/%d.nc' %
+               (k % 50, k), rng.choice(servers)) for k in range(2 * n // 3)]
+    return [rng.choice(unique) for k in range(n)]
+
+
+def with_dataframe(refs):
+    """The notebook before `ReferenceTable`."""
+    model_results = []
+    for model, scheme, url, server in refs:
+        model_results.append(dict(model=model, scheme=scheme, url=url,
+                                  server=server))
+    df = pd.DataFrame(model_results)
+    df = df.drop_duplicates()
+    total = df.groupby('scheme').size()
+    normalized_urns = df.copy(deep=True)
+    normalized_urns['scheme'] = normalized_urns['scheme'].map(
+        normalize_service_urn)
+    tables = [normalized_urns.groupby('scheme').size(),
+              normalized_urns.groupby(['model', 'scheme']).size()
+              .unstack('model'),
+              normalized_urns.groupby(['model', 'server']).size()
+              .unstack('model'),
+              normalized_urns.groupby(['scheme', 'server']).size()
+              .unstack('server')]
+    return len(df), [total] + tables
+
+
+def with_table(refs):
+    references = ReferenceTable()
+    references.extend(refs)
+    normalize = dict(scheme=normalize_service_urn)
+    tables = [references.counts('scheme'),
+              references.counts('scheme', normalize=normalize),
+              references.counts('scheme', 'model', normalize=normalize),
+              references.counts('server', 'model', normalize=normalize),
+              references.counts('scheme', 'server', normalize=normalize)]
+    return len(references), tables
+
+
+def check_missing_values():
+    """`ReferenceTable` with a batch where a whole column is missing (no
+    scheme), then the same references with one."""
+    references = ReferenceTable()
+    refs = [('roms', None, 'http://a.nc', servers[0]),
+            ('roms', None, 'http://a.nc', servers[0]),
+            ('hycom', None, 'http://b.nc', servers[1])]
+    assert references.extend(refs) == 2
+    assert references.extend([('roms', 'OGC:WMS', 'http://a.nc',
+                               servers[0])] + refs) == 1
+    assert references.frame()['scheme'].isnull().sum() == 2
+    assert references.counts('scheme').to_dict() == {'OGC:WMS': 1}
+
+
+def run(func, refs):
+    """Time `func(refs)`, then run it again to trace its peak memory."""
+    t0 = time.time()
+    result = func(refs)
+    elapsed = time.time() - t0
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func(refs)
+        peak = tracemalloc.get_traced_memory()[1] / 1024. ** 2
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    refs = references(n)
+    check_missing_values()
+
+    (rows, old), old_time, old_peak = run(with_dataframe, refs)
+    (unique, new), new_time, new_peak = run(with_table, refs)
+
+    assert rows == unique
+    for a, b in zip(old, new):
+        assert (a.fillna(0).values == b.values).all()
+
+    print('%d references, %d unique' % (n, unique))
+    for name, elapsed, peak in [('DataFrame:', old_time, old_peak),
+                                ('ReferenceTable:', new_time, new_peak)]:
+        memory = '' if peak is None else ', peak %7.1f MB' % peak
+        print('%-16s %6.2fs%s' % (name, elapsed, memory))
+    print('speed up: %.1fx' % (old_time / new_time))
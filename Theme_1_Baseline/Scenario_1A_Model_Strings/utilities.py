@@ -1,3 +1,17 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from owslib import fes
+
+# The service URN normalization and the CSW paging are shared with the
+# other notebooks, see csw_records.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from csw_records import service_mapping, normalize_service_urn  # noqa
+from csw_records import iter_pages  # noqa
+
 from IPython.core.display import HTML
 def css_styles():
     return HTML("""
@@ -17,15 +31,166 @@ def css_styles():
         </style>
     """)
 
-service_mapping = {
-    "odp" : "opendap"
-}
+# Element sets in increasing size.  `brief` has the title but no subjects,
+# `summary` adds the subjects and only `full` is guaranteed to carry the
+# `dct:references` (CSW 2.0.2, Table 6).
+element_sets = ['brief', 'summary', 'full']
+
+needs = {'titles': 'brief',
+         'subjects': 'summary',
+         'urls': 'full',
+         'records': 'full'}
+
+
+def query_plan(need, split=False):
+    """Return the cheapest `getrecords2` keywords that answer `need`: 'count',
+    'titles', 'subjects', 'urls' or 'records'.  Splitting the records client
+    side (`split=True`) needs the title and the subjects."""
+    if need == 'count' and not split:
+        return dict(resulttype='hits')
+    esn = needs.get(need, 'brief')
+    if split:
+        esn = max(esn, 'summary', key=element_sets.index)
+    return dict(esn=esn)
+
+
+def model_filter(models):
+    """One OR filter matching any of `models` in the title or the subject."""
+    filters = []
+    for model in models:
+        for propertyname in ['apiso:Title', 'apiso:Subject']:
+            filters.append(fes.PropertyIsLike(propertyname=propertyname,
+                                              literal='*%s*' % model,
+                                              wildCard='*'))
+    return fes.Or(filters)
+
+
+def matching_models(record, models):
+    """The `models` found in the record title or subjects, like the server
+    side (case insensitive) `PropertyIsLike`."""
+    text = ' '.join([record.title or ''] + list(record.subjects or []))
+    text = text.lower()
+    return [model for model in models if model.lower() in text]
+
+
+def survey_models(csw, models, need='urls', pagesize=100):
+    """Find the records that mention each of `models` in one catalog.
+
+    Counts only need `resulttype='hits'`, one small request per model and no
+    records transferred.  Anything else is a single OR query for all the
+    models, paged with the smallest element set that answers `need`, and the
+    records are split by model client side.
+
+    Returns {model: number of matches} for need='count' and
+    {model: [records]} otherwise."""
+    if need == 'count':
+        counts = dict()
+        for model in models:
+            csw.getrecords2(constraints=[model_filter([model])],
+                            **query_plan(need))
+            counts[model] = csw.results['matches']
+        return counts
+
+    found = dict((model, []) for model in models)
+    kw = query_plan(need, split=True)
+    for records in iter_pages(csw, [model_filter(models)], pagesize, **kw):
+        for record in records.values():
+            for model in matching_models(record, models):
+                found[model].append(record)
+    return found
+
+
+class ReferenceTable(object):
+    """Columnar accumulator of the (model, scheme, url, server) references
+    found in the catalogs.
+
+    Add the references in batches (e.g. one per catalog) with `extend`.
+    The values of each batch are interned first and duplicates are dropped
+    on the tuples of integer codes, so every column keeps one code per
+    reference and each distinct value is stored once, however many
+    (repeated) references the catalogs return.  `counts` builds the summary
+    tables straight from the codes."""
+    columns = ['model', 'scheme', 'url', 'server']
+
+    def __init__(self):
+        self.categories = dict((column, []) for column in self.columns)
+        self._codes = dict((column, []) for column in self.columns)
+        self._seen = set()
+
+    def extend(self, references):
+        """Add (model, scheme, url, server) tuples.  Returns the number of
+        new references."""
+        values = np.array(list(references), dtype=object)
+        if not len(values):
+            return 0
+        codes = []
+        for k, column in enumerate(self.columns):
+            # Missing values (None) get the code -1, as in `pd.Categorical`.
+            batch, uniques = pd.factorize(values[:, k])
+            categories = self.categories[column]
+            position = pd.Index(categories, dtype=object).get_indexer(uniques)
+            missing = position < 0
+            position[missing] = len(categories) + np.arange(missing.sum())
+            categories.extend(uniques[missing])
+            if len(position):
+                codes.append(np.where(batch < 0, -1, position[batch]))
+            else:  # All missing, `position[-1]` would raise.
+                codes.append(np.full(len(batch), -1, dtype=position.dtype))
+        seen = self._seen
+        new = np.zeros(len(values), dtype=bool)
+        for row, key in enumerate(zip(*[c.tolist() for c in codes])):
+            if key not in seen:
+                seen.add(key)
+                new[row] = True
+        if new.any():
+            for column, column_codes in zip(self.columns, codes):
+                self._codes[column].append(column_codes[new])
+        return int(new.sum())
+
+    def __len__(self):
+        return len(self._seen)
+
+    def codes(self, column):
+        """The codes of `column`, indexes into `self.categories[column]`."""
+        chunks = self._codes[column]
+        if len(chunks) != 1:
+            chunks[:] = [np.concatenate(chunks or [np.empty(0, np.int64)])]
+        return chunks[0]
+
+    def _factorize(self, column, normalize=None):
+        """Codes and (sorted) labels of `column`, with the labels optionally
+        mapped through `normalize` (e.g. `normalize_service_urn`)."""
+        labels = self.categories[column]
+        if normalize is not None:
+            labels = [normalize(label) for label in labels]
+        uniques = sorted(set(labels))
+        position = dict((label, k) for k, label in enumerate(uniques))
+        recode = np.array([position[label] for label in labels] + [-1],
+                          dtype=int)
+        return recode[self.codes(column)], uniques
 
+    def frame(self):
+        """The references as a DataFrame of categoricals."""
+        data = dict((column, pd.Categorical.from_codes(
+            self.codes(column), self.categories[column]))
+                    for column in self.columns)
+        return pd.DataFrame(data, columns=self.columns)
 
-def normalize_service_urn(urn):
-    urns = urn.split(':')
-    if urns[-1].lower() == "url":
-        del urns[-1]
-    if urns[-1] in service_mapping:
-        return service_mapping[urns[-1]]
-    return urns[-1].lower()
+    def counts(self, index, columns=None, normalize=None):
+        """Number of references by `index` (a Series), or by `index` and
+        `columns` (a DataFrame), like `df.groupby([index, columns]).size()
+        .unstack(columns)` with zeros instead of NaNs.  `normalize` maps a
+        column name to a function applied to its labels first."""
+        normalize = normalize or dict()
+        rows, row_labels = self._factorize(index, normalize.get(index))
+        if columns is None:
+            size = np.bincount(rows[rows >= 0], minlength=len(row_labels))
+            return pd.Series(size, index=pd.Index(row_labels, name=index))
+        cols, col_labels = self._factorize(columns, normalize.get(columns))
+        valid = (rows >= 0) & (cols >= 0)
+        rows, cols = rows[valid], cols[valid]
+        size = np.bincount(rows * len(col_labels) + cols,
+                           minlength=len(row_labels) * len(col_labels))
+        size = size.reshape(len(row_labels), len(col_labels))
+        return pd.DataFrame(size, index=pd.Index(row_labels, name=index),
+                            columns=pd.Index(col_labels, name=columns))
@@ -1,4 +1,16 @@
+import os
+import sys
+
 from IPython.core.display import HTML
+
+# The service URN normalization is shared with the other notebooks, see
+# csw_records.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+import csw_records  # noqa
+from csw_records import service_mapping  # noqa
+
+
 def css_styles():
     return HTML("""
         <style>
@@ -18,18 +30,8 @@ def css_styles():
     """)
 
 
-service_mapping = {
-    "odp" : "opendap"
-}
-
-
 def normalize_service_urn(urn):
     if " " in urn:
         # There is a space in this thing?  Just return it.
         return urn
-    urns = urn.split(':')
-    if urns[-1].lower() == "url":
-        del urns[-1]
-    if urns[-1] in service_mapping:
-        return service_mapping[urns[-1]]
-    return urns[-1].lower()
+    return csw_records.normalize_service_urn(urn)
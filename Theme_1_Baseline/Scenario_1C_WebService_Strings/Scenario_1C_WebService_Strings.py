@@ -56,14 +56,6 @@ from owslib.namespaces import Namespaces
 
 # <codecell>
 
-web_service_strings = ['urn:x-esri:specification:ServiceType:OPeNDAP',
-                       'urn:x-esri:specification:ServiceType:odp:url',
-                       'urn:x-esri:specification:ServiceType:WMS',
-                       'urn:x-esri:specification:ServiceType:wms:url',
-                       'urn:x-esri:specification:ServiceType:sos:url',
-                       'urn:x-esri:specification:ServiceType:wcs:url']
-
-
 services =      {'SOS'              : 'urn:x-esri:specification:ServiceType:sos:url',
                  'WMS'              : 'urn:x-esri:specification:ServiceType:wms:url',
                  'WCS'              : 'urn:x-esri:specification:ServiceType:wcs:url',
@@ -113,15 +105,8 @@ endpoints = ['http://www.nodc.noaa.gov/geoportal/csw',
 
 # <codecell>
 
-def service_urls(records,service_string='urn:x-esri:specification:ServiceType:wms:url'):
-    urls=[]
-    for key,rec in records.iteritems():
-        #create a generator object, and iterate through it until the match is found
-        #if not found, gets the default value (here "none")
-        url = next((d['url'] for d in rec.references if d['scheme'] == service_string), None)
-        if url is not None:
-            urls.append(url)
-    return urls
+from utilities import ServiceIndex
+
 records1 = []
 titles1 = []
 lenrecords1 = []
@@ -139,10 +124,13 @@ for endpoint in endpoints:
     try:
         csw = CatalogueServiceWeb(endpoint,timeout=100)
         csw.getrecords2(maxrecords = 100)
-        for web_service_string in web_service_strings:
-            urls1 = service_urls(csw.records,service_string=web_service_string)
+        # index all the service URLs in one pass, the scheme aliases
+        # (OPeNDAP/odp:url, WMS/wms:url) are merged
+        index = ServiceIndex(csw.records)
+        for service, service_string in services.items():
+            urls1 = index.urls(service_string)
             list3.append(urls1)
-            list1.append(web_service_string)
+            list1.append(service)
             list2.append(endpoint)
             list4.append(len(urls1))
             dict2['Service_URL']= list1
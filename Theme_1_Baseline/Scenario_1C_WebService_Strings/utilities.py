@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The service URN normalization and `ServiceIndex` are shared with the other
+# notebooks, see csw_records.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from csw_records import service_mapping, normalize_service_urn  # noqa
+from csw_records import ServiceIndex  # noqa
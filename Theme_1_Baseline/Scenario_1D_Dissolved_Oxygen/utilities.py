@@ -32,14 +32,10 @@ def css_styles():
     """)
 
 
-service_mapping = {
-    "odp" : "opendap"
-}
-
-def normalize_service_urn(urn):
-    urns = urn.split(':')
-    if urns[-1].lower() == "url":
-        del urns[-1]
-    if urns[-1] in service_mapping:
-        return service_mapping[urns[-1]]
-    return urns[-1].lower()
+# The service URN normalization is shared with the other notebooks, see
+# csw_records.py at the top of the repository.
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from csw_records import service_mapping, normalize_service_urn  # noqa
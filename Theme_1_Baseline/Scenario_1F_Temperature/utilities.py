@@ -2,25 +2,27 @@
 Utility functions for Temperature.ipynb
 """
 
+import os
+import sys
 from lxml import etree
 from io import BytesIO
 from warnings import warn
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
 
 # Scientific stack.
 import numpy as np
 from IPython.display import HTML
-from pandas import DataFrame, concat, read_csv
+from pandas import DataFrame, DatetimeIndex, concat, read_csv, to_datetime
 
 # Custom IOOS/ASA modules (available at PyPI).
 from owslib import fes
 from owslib.ows import ExceptionReport
 import requests
 
-from bs4 import BeautifulSoup
+# The station long names are shared with the other notebooks, see
+# station_names.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from station_names import StationNames  # noqa
 
 
 def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01', constraint='overlaps'):
@@ -44,30 +46,8 @@ def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01', constraint=
 
 def get_station_longName(station, provider):
     """Get longName for specific station using DescribeSensor
-    request."""
-    if provider.upper() == 'NDBC':
-        url = ('http://sdf.ndbc.noaa.gov/sos/server.php?service=SOS&'
-               'request=DescribeSensor&version=1.0.0&outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-               'procedure=urn:ioos:station:wmo:%s') % station
-    elif provider.upper() == 'COOPS':
-        url = ('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?service=SOS&'
-               'request=DescribeSensor&version=1.0.0&'
-               'outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-               'procedure=urn:ioos:station:NOAA.NOS.CO-OPS:%s') % station
-    try:
-        tree = etree.parse(urlopen(url))
-        root = tree.getroot()
-        namespaces = {'sml': "http://www.opengis.net/sensorML/1.0.1"}
-        longName = root.xpath("//sml:identifier[@name='longName']/sml:Term/sml:value/text()", namespaces=namespaces)
-        if len(longName) == 0:
-            # Just return the station id
-            return station
-        else:
-            return longName[0]
-    except Exception as e:
-        warn(e)
-        # Just return the station id
-        return station
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, provider)
 
 
 def collector2df(collector, station, sos_name, provider='COOPS'):
@@ -94,6 +74,53 @@ def collector2df(collector, station, sos_name, provider='COOPS'):
     return data_df
 
 
+def read_om_values(stream):
+    """Stream an O&M 1.0 GetObservation response with `iterparse` and return
+    the first `name`, the first `lowerCorner` (as a string) and the
+    `swe:values` tuple block split into one list of strings per field,
+    ready for a bulk NumPy conversion."""
+    found = dict(name=None, lowerCorner=None, values=None)
+    separators = dict(tokenSeparator=',', blockSeparator=' ',
+                      decimalSeparator='.')
+    for event, elem in etree.iterparse(stream, events=('end',),
+                                       huge_tree=True):
+        tag = etree.QName(elem).localname
+        if tag == 'TextBlock':
+            separators.update((key, value) for key, value in
+                              elem.attrib.items() if key in separators)
+        elif tag in found and found[tag] is None:
+            found[tag] = elem.text or ''
+        elem.clear()
+        if None not in found.values():
+            break
+
+    values = found['values']
+    if values is None:
+        raise ValueError('No values in the O&M response.')
+    token, block = separators['tokenSeparator'], separators['blockSeparator']
+    rows = values.strip().split(block)
+    fields = len(rows[0].split(token))
+    tokens = token.join(rows).split(token)
+    if separators['decimalSeparator'] != '.':
+        tokens = [t.replace(separators['decimalSeparator'], '.')
+                  for t in tokens]
+    columns = [tokens[k::fields] for k in range(fields)]
+    return found['name'], found['lowerCorner'], columns
+
+
+def om_times(column):
+    """Parse the O&M time field.  The usual fixed width UTC times
+    (2014-01-01T00:00:00Z) are converted in bulk by NumPy, anything else is
+    left to pandas."""
+    times = np.array(column)
+    if (len(times) and (np.char.str_len(times) == 20).all() and
+            np.char.endswith(times, 'Z').all()):
+        # Drop the `Z`, NumPy does not parse time zones.
+        times = times.astype('{}19'.format(times.dtype.kind))
+        return times.astype('datetime64[s]')
+    return to_datetime(column)
+
+
 def get_NERACOOS_SOS_data(get_caps_url, field, begin, end):
     """ This function gets data from NERACOOS buoys using SOS """
 
@@ -104,21 +131,19 @@ def get_NERACOOS_SOS_data(get_caps_url, field, begin, end):
                    'observedProperty=%s&offering=%s&'
                    'responseFormat=text%%2Fxml%%3Bsubtype%%3D"om/1.0.0"&'
                    'eventTime=%s/%s' % (field, offering, begin, end))
-        # Get response
-        response = requests.get(sos_url)
-        xml_soup = BeautifulSoup(response.text, "xml")
-
-        values = xml_soup.find('values').next
-
-        # Format the data into something that can be read by Pandas
-        formatted_data = 'date_time,Observed Data\n{0}'.format(values.replace(' ', '\n'))
-
-        data_df = read_csv(BytesIO(formatted_data), parse_dates=True, index_col='date_time')
-        name = xml_soup.find('name').next
+        # Parse the response as it streams in.
+        response = requests.get(sos_url, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        name, lat_lon_str, columns = read_om_values(response.raw)
+        response.close()
+
+        index = DatetimeIndex(om_times(columns[0]), name='date_time')
+        data = np.array(columns[1], dtype=np.float64)
+        data_df = DataFrame({'Observed Data': data}, index=index)
         data_df.name = name.split(':')[-1]
 
         # Get latitude and longitude
-        lat_lon_str = xml_soup.find('lowerCorner').next
         lat, lon = lat_lon_str.split(' ')
         data_df.latitude = lat
         data_df.longitude = lon
@@ -0,0 +1,145 @@
+"""
+Benchmark `survey_hits` against the serial endpoint x variable x location
+loop using a local stand-in CSW server that sleeps before every answer.
+
+    python benchmark_survey.py [latency in seconds]
+"""
+
+import sys
+import time
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # py3k
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from owslib import fes
+from owslib.csw import CatalogueServiceWeb
+
+from utilities import anytext_filter, survey_hits
+
+
+CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<csw:Capabilities version="2.0.2"
+    xmlns:csw="http://www.opengis.net/cat/csw/2.0.2"
+    xmlns:ows="http://www.opengis.net/ows"
+    xmlns:ogc="http://www.opengis.net/ogc"
+    xmlns:xlink="http://www.w3.org/1999/xlink">
+  <ows:ServiceIdentification>
+    <ows:Title>Stand-in CSW</ows:Title>
+    <ows:ServiceType>CSW</ows:ServiceType>
+    <ows:ServiceTypeVersion>2.0.2</ows:ServiceTypeVersion>
+  </ows:ServiceIdentification>
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetRecords">
+      <ows:DCP><ows:HTTP>
+        <ows:Get xlink:href="{url}"/>
+        <ows:Post xlink:href="{url}"/>
+      </ows:HTTP></ows:DCP>
+    </ows:Operation>
+  </ows:OperationsMetadata>
+  <ogc:Filter_Capabilities>
+    <ogc:Spatial_Capabilities>
+      <ogc:GeometryOperands>
+        <ogc:GeometryOperand>gml:Envelope</ogc:GeometryOperand>
+      </ogc:GeometryOperands>
+      <ogc:SpatialOperators>
+        <ogc:SpatialOperator name="BBOX"/>
+      </ogc:SpatialOperators>
+    </ogc:Spatial_Capabilities>
+    <ogc:Scalar_Capabilities>
+      <ogc:LogicalOperators/>
+    </ogc:Scalar_Capabilities>
+  </ogc:Filter_Capabilities>
+</csw:Capabilities>
+"""
+
+HITS = """<?xml version="1.0" encoding="UTF-8"?>
+<csw:GetRecordsResponse version="2.0.2"
+    xmlns:csw="http://www.opengis.net/cat/csw/2.0.2">
+  <csw:SearchStatus timestamp="2015-01-01T00:00:00Z"/>
+  <csw:SearchResults numberOfRecordsMatched="{matches}"
+      numberOfRecordsReturned="0" nextRecord="0" elementSet="full"/>
+</csw:GetRecordsResponse>
+"""
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def stand_in_csw(latency, port=0):
+    """Start a stand-in CSW server in a thread and return its url."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, body):
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.reply(CAPABILITIES.format(url=url))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            request = self.rfile.read(length)
+            time.sleep(latency)
+            self.reply(HITS.format(matches=len(request) % 97))
+
+    server = ThreadedHTTPServer(('127.0.0.1', port), Handler)
+    url = 'http://127.0.0.1:%d/csw' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return url
+
+
+def serial_hits(endpoints, names_dict, locations):
+    """The loop from test_multiple_endpoints_variables_locations."""
+    counts = dict()
+    for endpoint in endpoints:
+        csw = CatalogueServiceWeb(endpoint, timeout=60)
+        for var_name in names_dict:
+            or_filt = anytext_filter(names_dict[var_name]['names'])
+            for location, bounding_box in locations.items():
+                filter_list = [fes.And([fes.BBox(bounding_box), or_filt])]
+                csw.getrecords2(constraints=filter_list, resulttype='hits')
+                counts[(endpoint, location, var_name)] = csw.results['matches']
+    return counts
+
+
+if __name__ == '__main__':
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+
+    # Same shape as the notebook: 12 endpoints x 4 variables x 7 locations.
+    endpoints = [stand_in_csw(latency) for k in range(12)]
+    names_dict = dict((var_name, dict(names=['%s_%d' % (var_name, k)
+                                             for k in range(4)]))
+                      for var_name in ['waves', 'winds', 'currents',
+                                       'water_level'])
+    locations = dict(('region %d' % k, [-80 + k, 20, -70 + k, 30])
+                     for k in range(7))
+
+    t0 = time.time()
+    counts = serial_hits(endpoints, names_dict, locations)
+    serial = time.time() - t0
+
+    t0 = time.time()
+    df = survey_hits(endpoints, names_dict, locations, workers=24,
+                     per_endpoint=2)
+    concurrent = time.time() - t0
+
+    for (endpoint, location, var_name), matches in counts.items():
+        assert df.loc[(endpoint, location), var_name] == matches
+
+    print('%d queries, %.2fs latency each' % (len(counts), latency))
+    print('serial:     %6.2fs' % serial)
+    print('concurrent: %6.2fs (%.1fx)' % (concurrent, serial / concurrent))
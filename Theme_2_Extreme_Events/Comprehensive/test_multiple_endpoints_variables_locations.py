@@ -28,18 +28,13 @@
 # <codecell>
 
 import matplotlib.pyplot as plt
-import numpy as np
-
-from owslib.csw import CatalogueServiceWeb
-from owslib import fes
-from owslib.ows import ExceptionReport
 
 import folium
 import pandas as pd
-import itertools
 import datetime as dt
 from utilities import (fes_date_filter, service_urls, get_coordinates, inline_map, css_styles, 
-                       insert_progress_bar, update_progress_bar)
+                       insert_progress_bar, update_progress_bar, survey_hits,
+                       EndpointRegistry, CapabilitiesCache)
 css_styles()
 
 # <markdowncell>
@@ -154,6 +149,13 @@ endpoints = ['http://www.nodc.noaa.gov/geoportal/csw',
 # Set the maximum number of records the CSW will return
 max_records = 2000
 
+# Health of the endpoints from previous runs.  Endpoints that keep failing are
+# skipped for an hour and re-probed in the background once that has passed.
+registry = EndpointRegistry()
+registry.reprobe()
+# GetCapabilities of the endpoints, downloaded once and revalidated daily.
+capabilities = CapabilitiesCache()
+
 # <markdowncell>
 
 # ### Is data available for the basic oceanography variables in the CSW endpoints for multiple locations?
@@ -169,66 +171,36 @@ max_records = 2000
 # Add a waitbar to monitor status
 divid = insert_progress_bar(title='Searching catalogs. Please wait...', color='red')
 
-# Save all of the results in a list of Dataframes
-results = {}
-all_data = []
-
-count = 0
-# Loop through the csw endpoints
-for endpoint in endpoints:
-    print '\n' + endpoint
-    
-    csw = CatalogueServiceWeb(endpoint, timeout=60)
-    # loop through the variables
-    for var_name in names_dict:
-#         print '\n' + var_name.upper()
-        num_recs = []
-        for location, bounding_box in locations.iteritems():
-#             print location
-            
-            bbox = fes.BBox(bounding_box)
-            #use the search name to create search filter
-            or_filt = fes.Or([fes.PropertyIsLike(propertyname='apiso:AnyText',
-                                                 literal='*%s*' % val,
-                                                 escapeChar='\\',
-                                                 wildCard='*',
-                                                 singleChar='?') for val in names_dict[var_name]["names"]])
-            filter_list = [fes.And([ bbox, or_filt])]
-            # try request using multiple filters "and" syntax: [[filter1,filter2]]
-            try:
-                csw.getrecords2(constraints=filter_list, maxrecords=max_records, resulttype='hits')
-            except Exception as e:
-                print '\t' + 'ERROR - ' + str(e)
-                num_recs.append(np.NaN)
-            else:
-#                 print csw.results['matches']
-                num_recs.append(csw.results['matches'])
-            
-        results[var_name] = np.array(num_recs)
-
-    # Save the results
-    prod = list(itertools.product([endpoint], locations.keys()))
-    mi = pd.MultiIndex.from_tuples(prod, names=['endpoint', 'location'])
-    all_data.append(pd.DataFrame(results, index=mi))
-                     
+
+def progress(endpoint, var_name, location, matches, error, done, total):
+    if error is not None:
+        print '\t' + 'ERROR - ' + endpoint + ' - ' + error
     # Update progress bar
-    count += 1
-    percent_complete = (float(count)/float(len(endpoints)))*100
-    update_progress_bar(divid, percent_complete)
+    if done % len(locations) == 0:
+        percent_complete = (float(done)/float(total))*100
+        update_progress_bar(divid, percent_complete)
 
-# all_data_concat = pd.concat(all_data)
+# Query all the csw endpoints at once, a couple of requests per endpoint
+alldata_concat = survey_hits(endpoints, names_dict, locations, workers=16,
+                             per_endpoint=2, timeout=60, callback=progress,
+                             registry=registry, cache=capabilities)
+registry.save()
 
 # <markdowncell>
 
 # <div class="error"> Some servers have a maximum amount of records you can retrieve at once. See: https://github.com/ioos/system-test/issues/126</div>
 
+# <codecell>
+
+# Latency, success rate and circuit state of each endpoint
+registry.summary()[['latency', 'success_rate', 'last_error', 'available']]
+
 # <markdowncell>
 
 # #### Let's plot the results in a bar graph
 
 # <codecell>
 
-alldata_concat = pd.concat(all_data)
 endpoint_group = alldata_concat.groupby(level=0)
 # can uncomment this for a terser, but less well annotated plot
 # endpoint_group.plot(kind='barh')
@@ -271,72 +243,18 @@ print start_date + ' to ' + stop_date
 # Add a waitbar to monitor status
 divid = insert_progress_bar(title='Searching catalogs. Please wait...', color='red')
 
-# Save all of the results in a list of Dataframes
-results = {}
-recent_data = []
-
-count = 0
-# Loop through the csw endpoints
-for endpoint in endpoints:
-    print '\n' + endpoint
-
-    try:
-        csw = CatalogueServiceWeb(endpoint, timeout=60)
-    # continue processing if an endpoint is down or otherwise nonfunctional
-    # but report the exception returned from OWSLib
-    except ExceptionReport as e:
-        print('Error accessing CSW endpoint "{0}". Error report: {1}'.format(endpoint, e))
-        continue
-    # loop through the variables
-    for var_name in names_dict:
-#         print '\n' + var_name.upper()
-        num_recs = []
-        for location, bounding_box in locations.iteritems():
-#             print location
-            # convert User Input into FES filters
-            start, stop = fes_date_filter(start_date, stop_date)
-            bbox = fes.BBox(bounding_box)
-
-            #use the search name to create search filter
-            or_filt = fes.Or([fes.PropertyIsLike(propertyname='apiso:AnyText',
-                                                 literal='*%s*' % val,
-                                                 escapeChar='\\',
-                                                 wildCard='*',
-                                                 singleChar='?') for val in names_dict[var_name]["names"]])
-            filter_list = [fes.And([ bbox, start, stop, or_filt])]
-            # try request using multiple filters "and" syntax: [[filter1,filter2]]
-            try:
-                csw.getrecords2(constraints=filter_list, #maxrecords=max_records,
-                                resulttype='hits')
-                
-            except Exception as e:
-                print '\t' + 'ERROR - ' + str(e)
-                num_recs.append(np.NaN)
-            else:
-#                 print '\t' + str(len(csw.records)) + " csw records found"
-#                 print csw.results['matches']
-                num_recs.append(csw.results['matches'])
-            
-        results[var_name] = np.array(num_recs)
-
-    # Save the results
-    prod = list(itertools.product([endpoint], locations.keys()))
-    mi = pd.MultiIndex.from_tuples(prod, names=['endpoint', 'location'])
-    df = pd.DataFrame(results, index=mi)
-    # if all the entries in the entire endpoint have zero counts, do not include this
-    # endpoint provider
-    if (df.stack().fillna(0) != 0).any():
-        recent_data.append(df)
-    else:
-        continue
-
-                     
-    # Update progress bar
-    count += 1
-    percent_complete = (float(count)/float(len(endpoints)))*100
-    update_progress_bar(divid, percent_complete)
-
-recent_data_concat = pd.concat(recent_data)
+# convert User Input into FES filters
+start, stop = fes_date_filter(start_date, stop_date)
+recent_data = survey_hits(endpoints, names_dict, locations,
+                          filters=[start, stop], workers=16, per_endpoint=2,
+                          timeout=60, callback=progress, registry=registry,
+                          cache=capabilities)
+registry.save()
+
+# if all the entries in the entire endpoint have zero counts, do not include this
+# endpoint provider
+has_data = (recent_data.fillna(0) != 0).any(axis=1).groupby(level='endpoint').any()
+recent_data_concat = recent_data.loc[has_data[has_data].index.tolist()]
 
 # <markdowncell>
 
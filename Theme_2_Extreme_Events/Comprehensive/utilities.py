@@ -2,9 +2,28 @@
 Utilities file for test_multiple_endpoints_variables_locations.ipynb
 """
 
-from IPython.display import HTML, Javascript, display
+import os
+import sys
+import copy
+import time
 import uuid
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+from IPython.display import HTML, Javascript, display
 from owslib import fes
+try:
+    from owslib.catalogue.csw2 import CatalogueServiceWeb
+except ImportError:
+    from owslib.csw import CatalogueServiceWeb
+
+# The endpoint registry and the capabilities cache are shared with the other
+# notebooks, see csw_endpoints.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from csw_endpoints import EndpointRegistry, CapabilitiesCache  # noqa
 
 
 def insert_progress_bar(title='Please wait...', color='blue'):
@@ -60,6 +79,164 @@ def service_urls(records, service='odp:url'):
     return urls
 
 
+def anytext_filter(names):
+    """Return an `apiso:AnyText` OR filter matching any of `names`."""
+    filters = [fes.PropertyIsLike(propertyname='apiso:AnyText',
+                                  literal='*%s*' % val,
+                                  escapeChar='\\',
+                                  wildCard='*',
+                                  singleChar='?') for val in names]
+    if len(filters) == 1:  # fes.Or needs at least two operands.
+        return filters[0]
+    return fes.Or(filters)
+
+
+def survey_hits(endpoints, names_dict, locations, filters=None, workers=8,
+                per_endpoint=2, timeout=60, deadline=300, callback=None,
+                registry=None, cache=None):
+    """Count the CSW records for every (endpoint, variable, location) triple.
+
+    The `resulttype='hits'` queries are fanned out over `workers` threads,
+    with at most `per_endpoint` requests in flight against the same endpoint.
+    An endpoint gets `deadline` seconds from its first request; queries that
+    have not started by then, or that fail, are counted as NaN.
+
+    `filters` are extra fes filters (e.g. `fes_date_filter`) AND'ed to the
+    bounding box and names filters.  `callback(endpoint, var_name, location,
+    matches, error, done, total)` is called from the calling thread as each
+    result arrives.
+
+    With an `EndpointRegistry` the endpoints whose circuit is open are
+    skipped (NaN) and the outcome of every request is recorded.
+    With a `CapabilitiesCache` the clients are built from the cached
+    GetCapabilities documents.
+
+    Returns a DataFrame indexed by (endpoint, location) with one column per
+    variable, like the one built by the serial loop it replaces."""
+    filters = list(filters or [])
+    or_filts = dict((var_name, anytext_filter(names_dict[var_name]['names']))
+                    for var_name in names_dict)
+
+    pending = OrderedDict()
+    for endpoint in endpoints:
+        pending[endpoint] = deque((endpoint, var_name, location)
+                                  for var_name in names_dict
+                                  for location in locations)
+    total = sum(len(jobs) for jobs in pending.values())
+    active = dict.fromkeys(endpoints, 0)
+    started = dict()
+    clients = dict()
+    probing = set()
+    cond = threading.Condition()
+    results = deque()
+    if registry is not None:
+        for endpoint in endpoints:
+            if not registry.available(endpoint):
+                results.extend(job + (np.nan, 'endpoint failed recently')
+                               for job in pending.pop(endpoint))
+
+    def next_job():
+        with cond:
+            while True:
+                if not any(pending.values()):
+                    return None
+                for endpoint, jobs in pending.items():
+                    if jobs and active[endpoint] < per_endpoint:
+                        active[endpoint] += 1
+                        started.setdefault(endpoint, time.time())
+                        return jobs.popleft()
+                cond.wait()
+
+    def get_client(endpoint):
+        # The first worker to reach an endpoint downloads its GetCapabilities
+        # while holding the endpoint slot, the others wait for it (`probing`)
+        # and reuse a shallow copy so that `getrecords2` does not clobber a
+        # shared `results` attribute.
+        with cond:
+            while endpoint in probing:
+                cond.wait()
+            csw = clients.get(endpoint)
+            if csw is None:
+                probing.add(endpoint)
+        if csw is None:
+            try:
+                if registry is not None:
+                    csw = registry.probe(endpoint, timeout=timeout,
+                                         cache=cache)
+                elif cache is not None:
+                    csw = cache.client(endpoint, timeout=timeout)
+                else:
+                    csw = CatalogueServiceWeb(endpoint, timeout=timeout)
+            except Exception as e:
+                csw = e
+            with cond:
+                clients[endpoint] = csw
+                probing.discard(endpoint)
+                cond.notify_all()
+        if isinstance(csw, Exception):
+            raise csw
+        return copy.copy(csw)
+
+    def query(endpoint, var_name, location):
+        remaining = deadline - (time.time() - started[endpoint])
+        if remaining <= 0:
+            raise RuntimeError('deadline of %ss exceeded' % deadline)
+        csw = get_client(endpoint)
+        if registry is not None and not registry.available(endpoint):
+            raise RuntimeError('endpoint failed recently')
+        csw.timeout = min(timeout, remaining)
+        bbox = fes.BBox(locations[location])
+        filter_list = [fes.And([bbox] + filters + [or_filts[var_name]])]
+        t0 = time.time()
+        try:
+            csw.getrecords2(constraints=filter_list, resulttype='hits')
+        except Exception as e:
+            if registry is not None:
+                registry.record(endpoint, time.time() - t0, e)
+            raise
+        if registry is not None:
+            registry.record(endpoint, time.time() - t0)
+        return csw.results['matches']
+
+    def worker():
+        while True:
+            job = next_job()
+            if job is None:
+                break
+            try:
+                matches, error = query(*job), None
+            except Exception as e:
+                matches, error = np.nan, str(e)
+            with cond:
+                active[job[0]] -= 1
+                results.append(job + (matches, error))
+                cond.notify_all()
+
+    threads = [threading.Thread(target=worker)
+               for k in range(min(workers, total))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    index = pd.MultiIndex.from_tuples([(endpoint, location)
+                                       for endpoint in endpoints
+                                       for location in locations],
+                                      names=['endpoint', 'location'])
+    df = pd.DataFrame(np.nan, index=index, columns=sorted(names_dict))
+    done = 0
+    while done < total:
+        with cond:
+            while not results:
+                cond.wait(1)
+            endpoint, var_name, location, matches, error = results.popleft()
+        df.loc[(endpoint, location), var_name] = matches
+        done += 1
+        if callback is not None:
+            callback(endpoint, var_name, location, matches, error,
+                     done, total)
+    return df
+
+
 def get_coordinates(bounding_box, bounding_box_type=''):
     """Create bounding box coordinates for the map."""
     coordinates = []
@@ -47,12 +47,11 @@ from owslib.csw import CatalogueServiceWeb
 from owslib import fes
 
 import numpy as np
-from pandas import read_csv
 from pyoos.collectors.ndbc.ndbc_sos import NdbcSos
 from pyoos.collectors.coops.coops_sos import CoopsSos
 
 from utilities import (fes_date_filter, service_urls, get_coordinates,
-                       inline_map, css_styles, processStationInfo,
+                       inline_map, css_styles, StationCatalog, sos_networks,
                        get_ncfiles_catalog, new_axes, set_legend)
 
 css_styles()
@@ -208,16 +207,10 @@ print(len(ofrs))
 
 box_str = ','.join(str(e) for e in bounding_box)
 
-url = (('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?'
-        'service=SOS&request=GetObservation&version=1.0.0&'
-        'observedProperty=%s&bin=1&'
-        'offering=urn:ioos:network:NOAA.NOS.CO-OPS:CurrentsActive&'
-        'featureOfInterest=BBOX:%s&responseFormat=text/csv') %
-       (sos_name, box_str))
+# The CO-OPS and NDBC stations are listed concurrently into one table.
+catalog = StationCatalog.fetch(bounding_box, sos_name, sos_networks,
+                               params=dict(coops=dict(bin=1)))
 
-obs_loc_df = read_csv(url)
-
-print(url)
 print("Date: %s to %s" % (iso_start, iso_end))
 print("Lat/Lon Box: %s" % box_str)
 
@@ -227,7 +220,8 @@ print("Lat/Lon Box: %s" % box_str)
 
 # <codecell>
 
-st_list = processStationInfo(obs_loc_df, st_list, "coops")
+st_list = catalog.st_list()
+catalog.stations[catalog.stations['provider'] == 'coops']
 
 # <codecell>
 
@@ -254,25 +248,13 @@ print("Date: %s to %s" % (iso_start, iso_end))
 box_str = ','.join(str(e) for e in bounding_box)
 print("Lat/Lon Box: %s" % box_str)
 
-url = (('http://sdf.ndbc.noaa.gov/sos/server.php?'
-        'request=GetObservation&service=SOS&'
-        'version=1.0.0&'
-        'offering=urn:ioos:network:noaa.nws.ndbc:all&'
-        'featureofinterest=BBOX:%s&'
-        'observedproperty=%s&'
-        'responseformat=text/csv&') % (box_str, sos_name))
-
-print(url)
-obs_loc_df = read_csv(url)
-
 # <markdowncell>
 
 # #### NDBC Station information
 
 # <codecell>
 
-st_list = processStationInfo(obs_loc_df, st_list, "ndbc")
-st_list
+catalog.stations[catalog.stations['provider'] == 'ndbc']
 
 # <codecell>
 
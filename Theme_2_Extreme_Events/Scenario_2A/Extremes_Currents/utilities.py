@@ -2,6 +2,8 @@
 Utility functions for Scenario_A_Extreme_Currents.ipynb
 """
 
+import os
+import sys
 import fnmatch
 import lxml.html
 from urllib import urlopen
@@ -15,6 +17,12 @@ from pandas import DataFrame
 from IPython.display import HTML
 from netCDF4 import MFDataset, date2index, num2date
 
+# The station catalog is shared with the other notebooks, see
+# station_catalog.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_catalog import StationCatalog, station_table  # noqa
+
 
 def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
                     constraint='overlaps'):
@@ -96,20 +104,22 @@ def css_styles():
     """)
 
 
+# Network offerings `StationCatalog.fetch` lists the stations from.
+sos_networks = dict(
+    coops=('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS',
+           'urn:ioos:network:NOAA.NOS.CO-OPS:CurrentsActive'),
+    ndbc=('http://sdf.ndbc.noaa.gov/sos/server.php',
+          'urn:ioos:network:noaa.nws.ndbc:all'))
+
+
 def processStationInfo(obs_loc_df, st_list, source):
-    st_data = obs_loc_df['station_id']
-    lat_data = obs_loc_df['latitude (degree)']
-    lon_data = obs_loc_df['longitude (degree)']
-    for k in range(0, len(st_data)):
-        station_name = st_data[k]
-        if station_name in st_list:
-            pass
-        else:
-            st_list[station_name] = {}
-            st_list[station_name]["lat"] = lat_data[k]
-            st_list[station_name]["source"] = source
-            st_list[station_name]["lon"] = lon_data[k]
-            print(station_name)
+    """Add the stations of `obs_loc_df` missing from `st_list`.  See
+    `StationCatalog`."""
+    catalog = StationCatalog(station_table(obs_loc_df, source))
+    for station, info in catalog.st_list().items():
+        if station not in st_list:
+            st_list[station] = info
+            print(station)
     print("number of stations in bbox %s" % len(st_list.keys()))
     return st_list
 
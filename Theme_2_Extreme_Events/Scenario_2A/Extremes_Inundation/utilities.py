@@ -7,14 +7,12 @@ way in the future...
 Standard Library.
 """
 
-from lxml import etree
+import os
+import sys
 from io import BytesIO
+import datetime as dt
 import requests
 from warnings import warn
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
 
 # Scientific stack.
 import numpy as np
@@ -25,6 +23,14 @@ from pandas import DataFrame, concat, read_csv
 from owslib import fes
 from owslib.ows import ExceptionReport
 
+# The station long names and the request windows are shared with the
+# other notebooks, see station_names.py and request_windows.py at the top of
+# the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+from request_windows import time_windows, fetch_windows  # noqa
+
 
 name_list = ['water level',
              'sea_surface_height',
@@ -59,67 +65,77 @@ def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
 
 def get_Coops_longName(station):
     """Get longName for specific station from COOPS SOS using DescribeSensor
-    request."""
-    url = ('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?service=SOS&'
-           'request=DescribeSensor&version=1.0.0&'
-           'outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-           'procedure=urn:ioos:station:NOAA.NOS.CO-OPS:%s') % station
-    tree = etree.parse(urlopen(url))
-    root = tree.getroot()
-    path = "//sml:identifier[@name='longName']/sml:Term/sml:value/text()"
-    namespaces = dict(sml="http://www.opengis.net/sensorML/1.0.1")
-    longName = root.xpath(path, namespaces=namespaces)
-    if len(longName) == 0:
-        longName = station
-    return longName[0]
-
-
-def findMaxVal(data):
-    """Finds the max value given a json object."""
-    dates_array = []
-    vals_array = []
-    for x in data:
-        dates_array.append(str(x["t"]))
-        vals_array.append(x["v"])
-
-    p = np.array(vals_array, dtype=np.float)
-    x = np.arange(len(p))
-    max_val = np.amax(p)
-    max_idx = np.argmax(p)
-    return (max_val, len(p), dates_array[max_idx])
-
-
-def coops2data(collector, station_id, sos_name):
-    """Extract the Observation Data from the collector."""
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, 'coops')
+
+
+def tides_arrays(data):
+    """Times (datetime64[m], GMT) and values (float64, NaN when missing) of
+    the records of a tides API json response."""
+    count = len(data)
+    times = np.array([x["t"] for x in data], dtype='datetime64[m]')
+    values = np.fromiter((x["v"] or 'nan' for x in data), dtype=np.float64,
+                         count=count)
+    return times, values
+
+
+def findMaxVal(times, values):
+    """Finds the max value, the number of valid samples and the date of the
+    max in the `tides_arrays`."""
+    valid = np.isfinite(values)
+    if not valid.any():
+        return np.nan, 0, None
+    max_idx = np.where(valid, values, -np.inf).argmax()
+    date_string = str(times[max_idx]).replace('T', ' ')
+    return values[max_idx], int(valid.sum()), date_string
+
+
+def coops2data(collector, station_id, sos_name, workers=4, raw=False):
+    """Extract the Observation Data from the collector, one year per
+    request with `workers` requests at a time.  Returns the annual max,
+    number of samples and date of the max by year, plus the samples as a
+    (t, v) record array under 'raw' only when `raw` is True."""
     collector.features = [station_id]
     collector.variables = [sos_name]
-    station_data = dict()
-    # Loop through the years and get the data needed.
-    for year_station in range(int(collector.start_time.year),
-                              collector.end_time.year+1):
+
+    def fetch(start, stop):
         link = "http://tidesandcurrents.noaa.gov/api/datagetter?product="
         link += sos_name + "&application=NOS.COOPS.TAC.WL&"
-        date1 = "begin_date="+str(year_station)+"0101"
-        date2 = "&end_date="+str(year_station)+"1231"
+        date1 = "begin_date=" + start.strftime('%Y%m%d')
+        date2 = "&end_date=" + stop.strftime('%Y%m%d')
         datum = "&datum=MHHW"
         units = "&units=metric"
         station_request = "&station=%s" % station_id
         station_request += "&time_zone=GMT&units=english&format=json"
         http_request = link + date1 + date2 + units + datum + station_request
-        # print(http_request)
         d_r = requests.get(http_request, timeout=20)
+        d_r.raise_for_status()
         if "Great Lake station" in d_r.text:
-            pass
-        else:
-            key_list = d_r.json().keys()
-            if "data" in key_list:
-                data = d_r.json()['data']
-                max_value, num_samples, date_string = findMaxVal(data)
-                station_data[str(year_station)] = {"max": max_value,
-                                                   "num_samples": num_samples,
-                                                   "date_string": date_string,
-                                                   "raw": data}
-                # print("\tyear:", year_station, " MaxValue:", max_value)
+            return None
+        response = d_r.json()
+        if "data" not in response:
+            return None
+        # Reduce each year as it arrives, only the arrays are kept.
+        times, values = tides_arrays(response.pop("data"))
+        max_value, num_samples, date_string = findMaxVal(times, values)
+        year = {"max": max_value,
+                "num_samples": num_samples,
+                "date_string": date_string}
+        if raw:
+            year["raw"] = np.rec.fromarrays([times,
+                                             values.astype(np.float32)],
+                                            names=['t', 'v'])
+        return year
+
+    # Loop through the years and get the data needed.
+    windows = time_windows(dt.datetime(collector.start_time.year, 1, 1),
+                           dt.datetime(collector.end_time.year, 12, 31),
+                           period='year')
+    station_data = dict()
+    for (start, stop), year in zip(windows,
+                                   fetch_windows(fetch, windows, workers)):
+        if year is not None:
+            station_data[str(start.year)] = year
     return station_data
 
 
@@ -2,10 +2,12 @@
 Utility functions for Scenario_2A_Waves.ipynb
 """
 
+import os
+import sys
+import copy
 from lxml import etree
 from io import BytesIO
 import datetime as dt
-import calendar # used to get number of days in a month and year
 from warnings import warn
 try:
     from urllib.request import urlopen
@@ -20,6 +22,14 @@ import pandas as pd
 from owslib import fes
 from owslib.ows import ExceptionReport
 
+# The station long names and the request windows are shared with the
+# other notebooks, see station_names.py and request_windows.py at the top of
+# the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+from request_windows import time_windows, fetch_windows  # noqa
+
 
 def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
                     constraint='overlaps'):
@@ -43,72 +53,53 @@ def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
 
 def get_station_longName(station):
     """Get longName for specific station using DescribeSensor
-    request."""
-
-    url = ('http://sdf.ndbc.noaa.gov/sos/server.php?service=SOS&'
-           'request=DescribeSensor&version=1.0.0&outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-           'procedure=urn:ioos:station:wmo:%s') % station
-    tree = etree.parse(urlopen(url))
-    root = tree.getroot()
-    namespaces = {'sml': "http://www.opengis.net/sensorML/1.0.1"}
-    longName = root.xpath("//sml:identifier[@name='longName']/sml:Term/sml:value/text()", namespaces=namespaces)
-    if len(longName) == 0:
-        longName = station
-        return longName
-    else:
-        return longName[0]
-
-
-def get_station_data(collector, station_id, sos_name, field_of_interest):
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, 'ndbc')
+
+
+def stitch(pieces):
+    """Concatenate the time indexed `pieces` into one sorted series, dropping
+    the samples repeated at the window boundaries."""
+    pieces = [piece for piece in pieces if piece is not None and len(piece)]
+    if not pieces:
+        return pd.Series()
+    series = pd.concat(pieces).sort_index()
+    return series[~series.index.duplicated(keep='first')]
+
+
+def get_station_data(collector, station_id, sos_name, field_of_interest,
+                     workers=4):
     """
-    This function breaks up the SOS requests into one month chunks and
-    returns all of the data in a Pandas DataFrame
+    This function breaks up the SOS requests into one month chunks, fetches
+    them concurrently and returns all of the data as a list of yearly
+    Pandas Series
     """
-
-    collector.features = [station_id]
-    collector.variables = [sos_name]
-    #loop through the years and get the data needed
-    st_yr = int(collector.start_time.year)
-    ed_yr = int(collector.end_time.year+1)
-
-    yearly_df = []
-    # Only 31 days are allowed to be requested at once
-    for year_station in range(st_yr, ed_yr):
-        print 'Processing ' + str(year_station) + ' now...'
-        obs_df = pd.DataFrame()
-        for month in range(1, 13):
-            num_days = calendar.monthrange(year_station, month)[1]
-
-            st = dt.datetime(year_station, month, 1, 0, 0, 0)
-            ed = dt.datetime(year_station, month, num_days, 23, 59, 59)
-
-            start_time1 = dt.datetime.strptime(str(st), '%Y-%m-%d %H:%M:%S')
-            end_time1 = dt.datetime.strptime(str(ed), '%Y-%m-%d %H:%M:%S')
-
-            collector.start_time = start_time1
-            collector.end_time = end_time1
-
-            try:
-                response = collector.raw(responseFormat="text/csv")
-                #get the response then get the data
-                data_df = pd.read_csv(BytesIO(response.encode('utf-8')),
-                                      parse_dates=True,
-                                      index_col='date_time')
-                # Eliminate any data with NaN.
-                # data_df['date_time'] = data_df.Time.map(lambda x: pd.datetools.parse(x).time())
-                # data_df = data_df[np.isfinite(data_df[field_of_interest])]
-                if obs_df.empty:
-                    obs_df = data_df[field_of_interest]
-                else:
-                    obs_df = pd.concat([obs_df, data_df[field_of_interest]])
-            except Exception as e:
-                print str(e)
-        if not obs_df.empty:
-            yearly_df.append(obs_df)
-        else:
-            print '\t No Data'
-
-    return yearly_df
+    def fetch(start, stop):
+        # Each window gets its own copy of the collector, so the filters set
+        # below are not seen by the other threads.  The copies share the
+        # `server` (the SOS GetCapabilities), which is thread safe as `raw`
+        # only reads the GetObservation url from it and each call opens its
+        # own connection.  A new `NdbcSos()` per window would request the
+        # capabilities again.
+        chunk = copy.copy(collector)
+        chunk.features = [station_id]
+        chunk.variables = [sos_name]
+        chunk.start_time, chunk.end_time = start, stop
+        response = chunk.raw(responseFormat="text/csv")
+        data_df = pd.read_csv(BytesIO(response.encode('utf-8')),
+                              parse_dates=True,
+                              index_col='date_time')
+        return data_df[field_of_interest]
+
+    # Whole years, as the annual maxima are computed from them.
+    windows = time_windows(dt.datetime(collector.start_time.year, 1, 1),
+                           dt.datetime(collector.end_time.year, 12, 31,
+                                       23, 59, 59))
+    obs_df = stitch(fetch_windows(fetch, windows, workers=workers))
+    if obs_df.empty:
+        print '\t No Data'
+        return []
+    return [year_df for year, year_df in obs_df.groupby(obs_df.index.year)]
 
 
 def mod_df(arr, timevar, istart, istop, mod_name, ts):
@@ -33,7 +33,6 @@
 
 import os
 from datetime import datetime, timedelta
-from io import BytesIO
 
 import uuid
 import folium
@@ -46,11 +45,9 @@ from owslib import fes
 from scipy.stats import genextreme
 import numpy as np
 import pandas as pd
-from pyoos.collectors.ndbc.ndbc_sos import NdbcSos
-from pyoos.collectors.coops.coops_sos import CoopsSos
 
 from utilities import (fes_date_filter, service_urls, get_coordinates, insert_progress_bar, update_progress_bar,
-                       inline_map, css_styles, gather_station_info, get_ncfiles_catalog, new_axes, set_legend, nearxy)
+                       inline_map, css_styles, StationCatalog, sos_networks, get_ncfiles_catalog, new_axes, set_legend, nearxy)
 
 css_styles()
 
@@ -198,29 +195,15 @@ st_list = {}
 
 # <codecell>
 
-coops_collector = CoopsSos()
-# coops_collector.variables = data_dict["winds"]["sos_name"]
-coops_collector.server.identification.title
-# Don't specify start and end date in the filter and the most recent observation will be returned
-coops_collector.filter(bbox=bounding_box, variables=data_dict["winds"]["sos_name"])
-
-response = coops_collector.raw(responseFormat="text/csv")
-
-obs_loc_df = pd.read_csv(BytesIO(response.encode('utf-8')),
-                         parse_dates=True,
-                         index_col='date_time')
+# The CO-OPS and NDBC stations are listed concurrently (from their most recent
+# observation) into one table.
+catalog = StationCatalog.fetch(bounding_box, sos_name, sos_networks)
 
 # Save the station info in a larger global dict
-st_list = gather_station_info(obs_loc_df, st_list, "coops")
-
-# Now let's specify start and end times
-coops_collector.start_time = start_time
-coops_collector.end_time = end_time
+st_list = catalog.st_list()
 
-ofrs = coops_collector.server.offerings
-
-# Print the first 5 rows of the DataFrame
-obs_loc_df.head()
+# Print the first 5 CO-OPS stations
+catalog.stations[catalog.stations['provider'] == 'coops'].head()
 
 # <markdowncell>
 
@@ -228,29 +211,8 @@ obs_loc_df.head()
 
 # <codecell>
 
-ndbc_collector = NdbcSos()
-ndbc_collector.variables = data_dict["winds"]["sos_name"]
-ndbc_collector.server.identification.title
-# Don't specify start and end date in the filter and the most recent observation will be returned
-ndbc_collector.filter(bbox=bounding_box,
-                 variables=data_dict["winds"]["sos_name"])
-
-response = ndbc_collector.raw(responseFormat="text/csv")
-obs_loc_df = pd.read_csv(BytesIO(response.encode('utf-8')),
-                         parse_dates=True,
-                         index_col='date_time')
-
-# Save the station info in a larger global dict
-st_list = gather_station_info(obs_loc_df, st_list, "ndbc")
-
-# Now let's specify start and end times
-ndbc_collector.start_time = start_time
-ndbc_collector.end_time = end_time
-
-ofrs = ndbc_collector.server.offerings
-
-# Print the first 5 rows of the DataFrame
-obs_loc_df.head()
+# Print the first 5 NDBC stations
+catalog.stations[catalog.stations['provider'] == 'ndbc'].head()
 
 # <markdowncell>
 
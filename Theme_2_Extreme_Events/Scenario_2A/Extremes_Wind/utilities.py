@@ -1,6 +1,8 @@
 """
 Utility functions for Scenario_A_Extreme_Winds.ipynb
 """
+import os
+import sys
 from IPython.display import HTML, Javascript, display
 import uuid
 import fnmatch
@@ -19,6 +21,13 @@ from owslib.ows import ExceptionReport
 from pandas import DataFrame, read_csv
 from netCDF4 import MFDataset, date2index, num2date
 
+# The station long names and catalog are shared with the other notebooks, see
+# station_names.py and station_catalog.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+from station_catalog import StationCatalog, station_table  # noqa
+
 
 def insert_progress_bar(title='Please wait...', color='blue'):
     """Inserts a simple progress bar into the IPython notebook."""
@@ -75,30 +84,8 @@ def service_urls(records, service='odp:url'):
 
 def get_station_longName(station, provider):
     """Get longName for specific station using DescribeSensor
-    request."""
-    if provider.upper() == 'NDBC':
-        url = ('http://sdf.ndbc.noaa.gov/sos/server.php?service=SOS&'
-               'request=DescribeSensor&version=1.0.0&outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-               'procedure=urn:ioos:station:wmo:%s') % station
-    elif provider.upper() == 'COOPS':
-        url = ('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?service=SOS&'
-               'request=DescribeSensor&version=1.0.0&'
-               'outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-               'procedure=urn:ioos:station:NOAA.NOS.CO-OPS:%s') % station
-    try:
-        tree = etree.parse(urlopen(url))
-        root = tree.getroot()
-        namespaces = {'sml': "http://www.opengis.net/sensorML/1.0.1"}
-        longName = root.xpath("//sml:identifier[@name='longName']/sml:Term/sml:value/text()", namespaces=namespaces)
-        if len(longName) == 0:
-            # Just return the station id
-            return station
-        else:
-            return longName[0]
-    except Exception as e:
-        warn(e)
-        # Just return the station id
-        return station
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, provider)
 
 
 def collector2df(collector, station, sos_name, provider='COOPS'):
@@ -171,19 +158,20 @@ def css_styles():
     """)
 
 
+# Network offerings `StationCatalog.fetch` lists the stations from.
+sos_networks = dict(
+    coops=('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS',
+           'urn:ioos:network:NOAA.NOS.CO-OPS:MetActive'),
+    ndbc=('http://sdf.ndbc.noaa.gov/sos/server.php',
+          'urn:ioos:network:noaa.nws.ndbc:all'))
+
+
 def gather_station_info(obs_loc_df, st_list, source):
-    st_data = obs_loc_df['station_id']
-    lat_data = obs_loc_df['latitude (degree)']
-    lon_data = obs_loc_df['longitude (degree)']
-    for k in range(0, len(st_data)):
-        station_name = st_data[k]
-        if station_name in st_list:
-            continue
-        else:
-            st_list[station_name] = {}
-            st_list[station_name]["lat"] = lat_data[k]
-            st_list[station_name]["source"] = source
-            st_list[station_name]["lon"] = lon_data[k]
+    """Add the stations of `obs_loc_df` missing from `st_list`.  See
+    `StationCatalog`."""
+    catalog = StationCatalog(station_table(obs_loc_df, source))
+    for station, info in catalog.st_list().items():
+        st_list.setdefault(station, info)
     return st_list
 
 
@@ -49,11 +49,11 @@ import numpy as np
 import pandas as pd
 from pyoos.collectors.ndbc.ndbc_sos import NdbcSos
 from pyoos.collectors.coops.coops_sos import CoopsSos
-import requests
 
 from utilities import (date_range, coops2df, coops2data, find_timevar, find_ij, nearxy, service_urls, mod_df, 
                        get_coordinates, get_Coops_longName, inline_map, get_coops_sensor_name,css_styles,
-                       find_nearest, buildSFOUrls,findSFOIndexs,uv2ws,uv2wd,uv2wdws,isDataValid,cycleAndGetData)
+                       find_nearest, buildSFOUrls,findSFOIndexs,uv2ws,uv2wd,uv2wdws,isDataValid,cycleAndGetData,
+                       CatalogHarvest, RecordIndex, bulk_observations)
 
 import cStringIO
 from lxml import etree
@@ -132,18 +132,30 @@ not_filt = fes.Not([fes.PropertyIsLike(propertyname='apiso:AnyText',
 filter_list = [fes.And([ bbox, start, stop, or_filt, not_filt]) ]
 # connect to CSW, explore it's properties
 # try request using multiple filters "and" syntax: [[filter1,filter2]]
-csw.getrecords2(constraints=filter_list, maxrecords=1000, esn='full')
-print str(len(csw.records)) + " csw records found"
-for rec, item in csw.records.items():
+# The records are kept in a local store and only the ones modified since the
+# last run are requested (with a full harvest once a week).
+harvest = CatalogHarvest(endpoint, 'hf_radar_currents', filter_list)
+print str(harvest.update(csw)) + " new or modified csw records"
+records = harvest.records
+print str(len(records)) + " csw records found"
+for rec, item in records.items():
     print(item.title)
 
+# The same fes filters can be evaluated against the harvested records, so
+# trying another bounding box or list of names does not query the catalog.
+# The Dublin Core records have no temporal extent (RecordIndex would raise a
+# ValueError), so the dates are left to the catalog query above.
+index = RecordIndex(records)
+local_filters = [fes.And([bbox, or_filt, not_filt])]
+print str(len(index.query(local_filters))) + " records match the filters locally"
+
 # <markdowncell>
 
 # #### List end points available
 
 # <codecell>
 
-dap_urls = service_urls(csw.records)
+dap_urls = service_urls(records)
 #remove duplicates and organize
 dap_urls = sorted(set(dap_urls))
 print "Total DAP:",len(dap_urls)
@@ -152,7 +164,7 @@ print "\n".join(dap_urls[:])
 
 # <codecell>
 
-sos_urls = service_urls(csw.records,service='sos:url')
+sos_urls = service_urls(records,service='sos:url')
 #remove duplicates and organize
 sos_urls = sorted(set(sos_urls))
 print "Total SOS:",len(sos_urls)
@@ -215,14 +227,9 @@ print "Date: ",iso_start," to ", iso_end
 box_str=','.join(str(e) for e in bounding_box)
 print "Lat/Lon Box: ",box_str
 
-url = (('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?'
-       'service=SOS&request=GetObservation&version=1.0.0&'
-       'observedProperty=%s&bin=1&'
-       'offering=urn:ioos:network:NOAA.NOS.CO-OPS:CurrentsActive&'
-       'featureOfInterest=BBOX:%s&responseFormat=text/csv') % (sos_name, box_str))
-
-print url
-obs_loc_df = pd.read_csv(url)
+# One BBOX request returns the data of all the stations for the whole period.
+obs_loc_df, obs_data = bulk_observations('coops', bounding_box, jd_start,
+                                         jd_stop, sos_name)
 
 # <codecell>
 
@@ -250,56 +257,11 @@ print "Date: ",iso_start," to ", iso_end
 box_str=','.join(str(e) for e in bounding_box)
 print "Lat/Lon Box: ",box_str
 
-url = (('http://sdf.ndbc.noaa.gov/sos/server.php?'
-       'request=GetObservation&service=SOS&'
-       'version=1.0.0&'
-       'offering=urn:ioos:network:noaa.nws.ndbc:all&'
-       'featureofinterest=BBOX:%s&'
-       'observedproperty=%s&'
-       'responseformat=text/csv&')% (box_str,sos_name))
-
-
-print url
-obs_loc_df = pd.read_csv(url)
+obs_loc_df, ndbc_data = bulk_observations('ndbc', bounding_box, jd_start,
+                                          jd_stop, sos_name)
+obs_data.update(ndbc_data)
 st_list = processStationInfo(obs_loc_df,st_list,"ndbc")
 
-# <codecell>
-
-#function handles current requests
-def coopsCurrentRequest(station_id,tides_dt_start,tides_dt_end):
-    tides_data_options = "time_zone=gmt&application=ports_screen&format=json"
-    tides_url = "http://tidesandcurrents.noaa.gov/api/datagetter?"   
-    begin_datetime = "begin_date="+tides_dt_start
-    end_datetime = "&end_date="+tides_dt_end
-    current_dp = "&station="+station_id
-    full_url = tides_url+begin_datetime+end_datetime+current_dp+"&application=web_services&product=currents&units=english&"+tides_data_options
-    r = requests.get(full_url)
-    try:
-        r= r.json()
-    except:
-        return None
-    if 'data' in r:
-        r = r['data']
-        data_dt = []
-        data_spd = []
-        data_dir = []
-        for row in r:
-            #convert from knots to cm/s
-            data_spd.append(float(row['s'])*51.4444444)
-            data_dir.append(float(row['d']))            
-            date_time_val = dt.datetime.strptime(row['t'], '%Y-%m-%d %H:%M')
-            data_dt.append(date_time_val)
-            
-        data = {}
-        data['sea_water_speed (cm/s)'] = np.array(data_spd)
-        data['direction_of_sea_water_velocity (degree)'] = np.array(data_dir)
-        time = np.array(data_dt)
-        
-        df = pd.DataFrame(data=data,index=time,columns = ['sea_water_speed (cm/s)','direction_of_sea_water_velocity (degree)'] )    
-        return df
-    else:
-        return None
-
 # <markdowncell>
 
 # <div class="warning"><strong>NDBC DAP</strong> - NDBC DAP does not have the most recent observations</div>
@@ -346,22 +308,6 @@ def ndbcCurrentRequest(station_id,dt_start,dt_end):
     
     return main_df
 
-# <codecell>
-
-print "Date: ",iso_start," to ", iso_end
-date_range_string = iso_start+"/"+iso_end
-#i.e date range    2011-03-01T00:00Z/2011-03-02T00:00Z
-def ndbcSOSRequest(station,date_range):
-    
-    url = ('http://sdf.ndbc.noaa.gov/sos/server.php?'
-     'request=GetObservation&service=SOS&version=1.0.0'
-     '&offering=%s&'
-     'observedproperty=Currents&responseformat=text/csv'
-     '&eventtime=%s') % (station,date_range)
-
-    obs_loc_df = pd.read_csv(url)
-    return obs_loc_df
-
 # <markdowncell>
 
 # #### Get the observation data from the stations identified
@@ -379,15 +325,8 @@ display(pb)
 
 count = 0
 for station_index in st_list.keys(): 
-        
-    st =  station_index.split(":")[-1]
-    tides_dt_start = jd_start.strftime('%Y%m%d %H:%M')
-    tides_dt_end = jd_stop.strftime('%Y%m%d %H:%M')
-    
-    if st_list[station_index]['source'] == "coops":
-        df = coopsCurrentRequest(st,tides_dt_start,tides_dt_end)
-    elif st_list[station_index]['source'] == "ndbc":
-        df = ndbcSOSRequest(station_index,date_range_string)
+    # Already downloaded with the station list (see bulk_observations).
+    df = obs_data.get(station_index)
     
     if (df is not None) and (len(df)>0):
         st_list[station_index]['hasObsData'] = True
@@ -2,9 +2,18 @@
 Utility functions for Scenario_A_Extreme_Currents.ipynb
 """
 
+import sys
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import operator
 from lxml import etree
 from io import BytesIO
+from collections import OrderedDict, defaultdict
 from warnings import warn
+from multiprocessing.pool import ThreadPool
 import requests
 try:
     from urllib.request import urlopen
@@ -20,11 +29,21 @@ from bs4 import BeautifulSoup
 
 # Custom IOOS/ASA modules (available at PyPI).
 from owslib import fes
+from owslib.csw import CswRecord
 from owslib.ows import ExceptionReport
+from owslib.util import element_to_string
 
 import datetime as dt
 from shapely.geometry import Point
 
+# The station long names and the CSW paging are shared with the other
+# notebooks, see station_names.py and csw_records.py at the top of the
+# repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+from csw_records import iter_pages  # noqa
+
 
 def date_range(start_date='1900-01-01', stop_date='2100-01-01',
                constraint='overlaps'):
@@ -48,19 +67,9 @@ def date_range(start_date='1900-01-01', stop_date='2100-01-01',
 
 def get_Coops_longName(station):
     """Get longName for specific station from COOPS SOS using DescribeSensor
-    request."""
-    url = ('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?service=SOS&'
-           'request=DescribeSensor&version=1.0.0&'
-           'outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-           'procedure=urn:ioos:station:NOAA.NOS.CO-OPS:%s') % station
-    tree = etree.parse(urlopen(url))
-    root = tree.getroot()
-    path = "//sml:identifier[@name='longName']/sml:Term/sml:value/text()"
-    namespaces = dict(sml="http://www.opengis.net/sensorML/1.0.1")
-    longName = root.xpath(path, namespaces=namespaces)
-    if len(longName) == 0:
-        longName = station
-    return longName[0]
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, 'coops')
+
 
 def get_coops_sensor_name(station):
     '''
@@ -145,6 +154,100 @@ def coops2df(collector, station_id, sos_name, iso_start, iso_end,use_procedure=F
     return data_df
 
 
+# GetObservation by network offering (all the stations in a BBOX at once).
+# `max_days` is the longest time range requested that way, longer ones are
+# requested station by station.
+bulk_sos = dict(
+    coops=dict(url='http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS',
+               offering='urn:ioos:network:NOAA.NOS.CO-OPS:CurrentsActive',
+               params=dict(bin=1), max_days=31),
+    ndbc=dict(url='http://sdf.ndbc.noaa.gov/sos/server.php',
+              offering='urn:ioos:network:noaa.nws.ndbc:all',
+              params=dict(), max_days=31))
+
+
+def sos_csv(provider, observed_property, offering=None, bbox=None,
+            start=None, stop=None, session=None, timeout=120):
+    """CSV GetObservation from one of the `bulk_sos` providers, for the
+    network offering (default) or a station, optionally restricted to the
+    `bbox` [lon_min, lat_min, lon_max, lat_max] and to the time range.
+    Without a time range the servers return the latest observation."""
+    server = bulk_sos[provider]
+    params = dict(service='SOS', request='GetObservation', version='1.0.0',
+                  offering=offering or server['offering'],
+                  observedProperty=observed_property,
+                  responseFormat='text/csv')
+    params.update(server['params'])
+    if bbox is not None:
+        params['featureOfInterest'] = 'BBOX:' + ','.join(str(e) for e in bbox)
+    if start is not None:
+        fmt = '%Y-%m-%dT%H:%M:%SZ'
+        params['eventTime'] = '/'.join(t.strftime(fmt) for t in (start, stop))
+    r = (session or requests).get(server['url'], params=params,
+                                  timeout=timeout)
+    r.raise_for_status()
+    if 'csv' not in r.headers.get('Content-Type', ''):
+        root = etree.fromstring(r.content)
+        raise ExceptionReport(root, etree.QName(root).namespace)
+    return read_csv(BytesIO(r.content), parse_dates=['date_time'])
+
+
+def split_stations(df):
+    """Station locations (one row per `station_id`) and {station_id:
+    DataFrame indexed by date_time} of a multi station SOS CSV."""
+    columns = ['station_id', 'latitude (degree)', 'longitude (degree)']
+    locations = df[columns].drop_duplicates('station_id')
+    data = dict((station, group.set_index('date_time'))
+                for station, group in df.groupby('station_id'))
+    return locations.reset_index(drop=True), data
+
+
+def bulk_observations(provider, bbox, start, stop, observed_property,
+                      workers=8):
+    """All the observations of `provider` in `bbox` between the datetimes
+    `start` and `stop` with a single BBOX GetObservation, split locally by
+    station.
+
+    When the range exceeds the `max_days` of the provider, or the server
+    rejects the bulk request, the stations are listed from their latest
+    observation and requested one by one, `workers` at a time.  Returns the
+    station locations and {station_id: DataFrame}."""
+    session = requests.Session()
+    days = (stop - start).total_seconds() / (24 * 60 * 60)
+    if days <= bulk_sos[provider]['max_days']:
+        try:
+            return split_stations(sos_csv(provider, observed_property,
+                                          bbox=bbox, start=start, stop=stop,
+                                          session=session))
+        except (ExceptionReport, requests.RequestException) as e:
+            warn('Bulk {} request failed, requesting each station: '
+                 '{}'.format(provider, e))
+
+    locations, _ = split_stations(sos_csv(provider, observed_property,
+                                          bbox=bbox, session=session))
+
+    def station_csv(station):
+        try:
+            return station, sos_csv(provider, observed_property,
+                                    offering=station, start=start, stop=stop,
+                                    session=session)
+        except Exception as e:
+            warn('{}: {}'.format(station, e))
+            return station, None
+
+    stations = list(locations['station_id'])
+    data = dict()
+    if stations:
+        pool = ThreadPool(min(workers, len(stations)))
+        try:
+            for station, df in pool.map(station_csv, stations):
+                if df is not None:
+                    data[station] = df.set_index('date_time')
+        finally:
+            pool.close()
+    return locations, data
+
+
 def mod_df(arr, timevar, istart, istop, mod_name, ts):
     """Return time series (DataFrame) from model interpolated onto uniform time
     base."""
@@ -185,6 +288,302 @@ def service_urls(records, service='odp:url'):
     return urls
 
 
+def filter_key(constraints, moving=('apiso:TempExtent_begin',
+                                     'apiso:TempExtent_end')):
+    """Hash of the filter XML of `constraints` (as passed to
+    `csw.getrecords2`).  The literals compared with the `moving` properties
+    (a time window that follows the current date) are left out."""
+    xml = fes.FilterRequest().setConstraintList(constraints)
+    root = etree.fromstring(element_to_string(xml))
+    for element in root.iter():
+        names = [child.text for child in element
+                 if etree.QName(child).localname == 'PropertyName']
+        if any(name in moving for name in names):
+            for child in element:
+                if etree.QName(child).localname == 'Literal':
+                    child.text = ''
+    return hashlib.sha1(etree.tostring(root)).hexdigest()
+
+
+class CatalogHarvest(object):
+    """Records of a CSW query kept in a local SQLite file and refreshed
+    incrementally.
+
+    The first `update` harvests everything matching the constraints.  Later
+    ones only ask for the records with a `dct:modified` stamp at or after the
+    newest one already stored (the watermark) and merge them in, so a daily
+    run costs in proportion to what changed in the catalog.  Records deleted
+    from the catalog, or that left a moving time window, only go away with a
+    full harvest, done when the last one is older than `max_age` seconds.
+
+    `name` identifies the query (e.g. the scenario) for `endpoint`.  The
+    records and the watermark are stored per `constraints` (see
+    `filter_key`), so changing the bounding box or the filter starts a new
+    harvest."""
+    def __init__(self, endpoint, name, constraints, fname=None,
+                 max_age=7*24*60*60):
+        if fname is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache',
+                                'ioos_system_test')
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            fname = os.path.join(path, 'harvest.sqlite')
+        self.constraints = constraints
+        self.query = '{} {} {}'.format(endpoint, name,
+                                       filter_key(constraints))
+        self.max_age = max_age
+        self.db = sqlite3.connect(fname)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS records (
+                query TEXT, identifier TEXT, modified TEXT, xml BLOB,
+                PRIMARY KEY (query, identifier))""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS harvests (
+                query TEXT PRIMARY KEY, watermark TEXT, full REAL)""")
+
+    def _harvest(self):
+        row = self.db.execute('SELECT watermark, full FROM harvests '
+                              'WHERE query = ?', (self.query,)).fetchone()
+        return row or (None, None)
+
+    @property
+    def watermark(self):
+        """Newest `dct:modified` stamp stored."""
+        return self._harvest()[0]
+
+    def update(self, csw, pagesize=100, full=False):
+        """Fetch the records matching the constraints modified since the
+        watermark, or all of them when `full` or the last full harvest is
+        too old.  Returns the number of records fetched."""
+        constraints = self.constraints
+        watermark, last_full = self._harvest()
+        full = (full or watermark is None or last_full is None or
+                time.time() - last_full > self.max_age)
+        if not full:
+            since = fes.PropertyIsGreaterThanOrEqualTo(
+                propertyname='apiso:Modified', literal=watermark)
+            constraints = [list(c) + [since] if isinstance(c, list) else
+                           [c, since] for c in constraints]
+        count = 0
+        with self.db:
+            if full:
+                self.db.execute('DELETE FROM records WHERE query = ?',
+                                (self.query,))
+                watermark, last_full = None, time.time()
+            for records in iter_pages(csw, constraints, pagesize, esn='full'):
+                for identifier, record in records.items():
+                    modified = record.modified
+                    if modified and (watermark is None or
+                                     modified > watermark):
+                        watermark = modified
+                    self.db.execute('INSERT OR REPLACE INTO records VALUES '
+                                    '(?, ?, ?, ?)',
+                                    (self.query, identifier, modified,
+                                     sqlite3.Binary(record.xml)))
+                    count += 1
+            self.db.execute('INSERT OR REPLACE INTO harvests VALUES '
+                            '(?, ?, ?)', (self.query, watermark, last_full))
+        return count
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM records WHERE '
+                               'query = ?', (self.query,)).fetchone()[0]
+
+    @property
+    def records(self):
+        """The stored records, like `csw.records`."""
+        records = OrderedDict()
+        for identifier, xml in self.db.execute(
+                'SELECT identifier, xml FROM records WHERE query = ? '
+                'ORDER BY identifier', (self.query,)):
+            records[identifier] = CswRecord(etree.fromstring(bytes(xml)))
+        return records
+
+
+class RecordIndex(object):
+    """In memory index of CSW records that evaluates `fes` filters locally.
+
+    A trigram index over the text of the records narrows down the candidates
+    of each `PropertyIsLike` before its pattern is checked, and the bounding
+    boxes are kept in an array for `BBox`.  `fes.And`, `fes.Or` and `fes.Not`
+    trees (like the `date_range` and name filters) are evaluated as boolean
+    masks, so searching again for a new box or list of names takes
+    milliseconds.
+
+    Text matching is case insensitive, like the catalogs.  A property a
+    record does not have does not exclude it, also under `fes.Not`.  A
+    property none of the records has (e.g. the temporal extent, not in the
+    Dublin Core records) raises a ValueError: leave those filters to the
+    catalog query."""
+    properties = {'apiso:AnyText': 'anytext', 'csw:AnyText': 'anytext',
+                  'apiso:Title': 'title', 'dc:title': 'title',
+                  'apiso:Subject': 'subject', 'dc:subject': 'subject',
+                  'apiso:Abstract': 'abstract', 'dct:abstract': 'abstract',
+                  'apiso:Identifier': 'identifier',
+                  'dc:identifier': 'identifier',
+                  'apiso:Type': 'type', 'dc:type': 'type',
+                  'apiso:Modified': 'modified', 'dct:modified': 'modified',
+                  'apiso:TempExtent_begin': 'begin',
+                  'apiso:TempExtent_end': 'end'}
+    text_fields = ['anytext', 'title', 'subject', 'abstract']
+
+    comparisons = {fes.PropertyIsEqualTo: operator.eq,
+                   fes.PropertyIsNotEqualTo: operator.ne,
+                   fes.PropertyIsLessThan: operator.lt,
+                   fes.PropertyIsGreaterThan: operator.gt,
+                   fes.PropertyIsLessThanOrEqualTo: operator.le,
+                   fes.PropertyIsGreaterThanOrEqualTo: operator.ge}
+
+    def __init__(self, records):
+        self.records = records
+        self.ids = list(records)
+        self.values = dict((field, []) for field in
+                           set(self.properties.values()))
+        self.bbox = np.empty((len(self.ids), 4))
+        self.bbox.fill(np.nan)
+        for k, identifier in enumerate(self.ids):
+            record = records[identifier]
+            subjects = [subject for subject in record.subjects or []
+                        if subject]
+            fields = dict(title=record.title, abstract=record.abstract,
+                          subject=' '.join(subjects) or None,
+                          identifier=identifier, type=record.type,
+                          modified=record.modified, begin=None, end=None)
+            fields['anytext'] = ' '.join(fields[field] or '' for field in
+                                         ['title', 'subject', 'abstract'])
+            for field, value in fields.items():
+                self.values[field].append(value)
+            box = record.bbox
+            if box is not None and None not in (box.minx, box.miny,
+                                                box.maxx, box.maxy):
+                self.bbox[k] = [float(box.minx), float(box.miny),
+                                float(box.maxx), float(box.maxy)]
+        self.trigrams = dict()
+        for field in self.text_fields:
+            trigrams = self.trigrams[field] = defaultdict(set)
+            for k, value in enumerate(self.values[field]):
+                value = (value or '').lower()
+                for i in range(len(value) - 2):
+                    trigrams[value[i:i+3]].add(k)
+
+    def _field(self, propertyname):
+        try:
+            field = self.properties[propertyname]
+        except KeyError:
+            raise ValueError('Cannot evaluate {!r} locally'.format(
+                propertyname))
+        values = self.values[field]
+        if values and all(value is None for value in values):
+            raise ValueError('Cannot evaluate {!r} locally, the records do '
+                             'not have it'.format(propertyname))
+        return field
+
+    def _missing(self, field):
+        return np.array([value is None for value in self.values[field]],
+                        dtype=bool)
+
+    def _like(self, f):
+        field = self._field(f.propertyname)
+        pattern, words, word = [], [], ''
+        chars = iter(f.literal)
+        for char in chars:
+            if char == f.escapeChar:
+                char = next(chars, '')
+            elif char in (f.wildCard, f.singleChar):
+                pattern.append('.*' if char == f.wildCard else '.')
+                words.append(word)
+                word = ''
+                continue
+            pattern.append(re.escape(char))
+            word += char.lower()
+        words.append(word)
+        regex = re.compile('^{}$'.format(''.join(pattern)),
+                           re.IGNORECASE | re.DOTALL)
+
+        candidates = range(len(self.ids))
+        trigrams = self.trigrams.get(field)
+        if trigrams is not None:
+            for word in words:
+                for i in range(len(word) - 2):
+                    candidates = trigrams.get(word[i:i+3], set()).intersection(
+                        candidates)
+        mask = np.zeros(len(self.ids), dtype=bool)
+        values = self.values[field]
+        for k in candidates:
+            if values[k] is not None and regex.match(values[k]):
+                mask[k] = True
+        return mask
+
+    def _compare(self, values, test):
+        return np.array([value is not None and test(value)
+                         for value in values], dtype=bool)
+
+    def _evaluate(self, f):
+        """Masks of the records matching `f` and of those for which it is
+        unknown (a property is missing), as in SQL's three-valued logic."""
+        if isinstance(f, (fes.And, fes.Or)):
+            results = [self._evaluate(op) for op in f.operations]
+            true = np.array([r[0] for r in results])
+            false = np.array([~r[0] & ~r[1] for r in results])
+            if isinstance(f, fes.And):
+                true, false = true.all(axis=0), false.any(axis=0)
+            else:
+                true, false = true.any(axis=0), false.all(axis=0)
+            return true, ~true & ~false
+        if isinstance(f, fes.Not):
+            true, unknown = self._evaluate(f.operations[0])
+            return ~true & ~unknown, unknown
+        if isinstance(f, fes.PropertyIsLike):
+            field = self._field(f.propertyname)
+            return self._like(f), self._missing(field)
+        if isinstance(f, fes.BBox):
+            x0, y0, x1, y1 = [float(v) for v in f.bbox]
+            minx, miny, maxx, maxy = self.bbox.T
+            unknown = np.isnan(minx)
+            if len(unknown) and unknown.all():
+                raise ValueError('Cannot evaluate the BBox locally, the '
+                                 'records do not have one')
+            with np.errstate(invalid='ignore'):
+                return ((minx <= x1) & (maxx >= x0) &
+                        (miny <= y1) & (maxy >= y0)), unknown
+        if isinstance(f, fes.PropertyIsNull):
+            field = self._field(f.propertyname)
+            return self._missing(field), np.zeros(len(self.ids), dtype=bool)
+        if isinstance(f, fes.PropertyIsBetween):
+            field = self._field(f.propertyname)
+            return (self._compare(self.values[field],
+                                  lambda value: f.lower <= value <= f.upper),
+                    self._missing(field))
+        op = self.comparisons.get(type(f))
+        if op is None:
+            raise ValueError('Cannot evaluate {} locally'.format(
+                type(f).__name__))
+        field = self._field(f.propertyname)
+        return (self._compare(self.values[field],
+                              lambda value: op(value, f.literal)),
+                self._missing(field))
+
+    def mask(self, f):
+        """Boolean mask of the records matching the `fes` filter `f`, or
+        for which it is unknown."""
+        true, unknown = self._evaluate(f)
+        return true | unknown
+
+    def query(self, constraints):
+        """The records matching `constraints` as passed to `getrecords2`:
+        a list of filters OR'ed together, where a nested list is AND'ed."""
+        mask = np.zeros(len(self.ids), dtype=bool)
+        for constraint in constraints:
+            if isinstance(constraint, list):
+                # Excluded when any filter is false, not merely unknown.
+                false = [~true & ~unknown for true, unknown in
+                         map(self._evaluate, constraint)]
+                mask |= ~np.logical_or.reduce(false)
+            else:
+                mask |= self.mask(constraint)
+        return OrderedDict((self.ids[k], self.records[self.ids[k]])
+                           for k in np.flatnonzero(mask))
+
+
 def nearxy(x, y, xi, yi):
     """Find the indices x[i] of arrays (x,y) closest to the points (xi, yi)."""
     ind = np.ones(len(xi), dtype=int)
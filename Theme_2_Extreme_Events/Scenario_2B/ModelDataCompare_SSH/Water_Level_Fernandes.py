@@ -14,8 +14,6 @@ import iris
 import pyoos
 import owslib
 
-from utilities import timeit
-
 start_time = time.time()
 
 
@@ -88,28 +86,34 @@ filter_list = [fes.And([fes.BBox(bbox), begin, end, or_filt, not_filt])]
 
 # In[ ]:
 
-from owslib.csw import CatalogueServiceWeb
+from utilities import CachedCatalogueServiceWeb, ServiceIndex, iter_pages
 
+# GetRecords responses are cached on disk for a day, re-running the notebook
+# does not hit the catalog again.
 endpoint = 'http://www.ngdc.noaa.gov/geoportal/csw'
-csw = CatalogueServiceWeb(endpoint, timeout=60)
-csw.getrecords2(constraints=filter_list, maxrecords=1000, esn='full')
+csw = CachedCatalogueServiceWeb(endpoint, timeout=60)
+
+# Walk the results one page at a time keeping only the titles and an index of
+# the service URLs.
+titles, services = [], ServiceIndex()
+for records in iter_pages(csw, filter_list, pagesize=100, esn='full'):
+    titles.extend(item.title for item in records.values())
+    services.add(records)
+
+dap_urls = services.urls('odp:url')
+sos_urls = services.urls('sos:url')
 
 log.info(fmt(' Catalog information '))
 log.info("URL: {}".format(endpoint))
 log.info("CSW version: {}".format(csw.version))
-log.info("Number of datasets available: {}".format(len(csw.records.keys())))
+log.info("Number of datasets available: {}".format(len(titles)))
 
 
 # In[ ]:
 
-from utilities import service_urls
-
-dap_urls = service_urls(csw.records, service='odp:url')
-sos_urls = service_urls(csw.records, service='sos:url')
-
 log.info(fmt(' CSW URLs '))
-for rec, item in csw.records.items():
-    log.info('{}'.format(item.title))
+for title in titles:
+    log.info('{}'.format(title))
 
 log.info(fmt(' DAP URLs '))
 for url in dap_urls:
@@ -160,7 +164,7 @@ log.info('SOS URL request: {}'.format(url))
 
 # In[ ]:
 
-from utilities import get_coops_longname, to_html
+from utilities import StationNames, get_coops_longname, to_html
 
 columns = {'datum_id': 'datum',
            'sensor_id': 'sensor',
@@ -175,7 +179,9 @@ observations.rename(columns=columns, inplace=True)
 observations['datum'] = [s.split(':')[-1] for s in observations['datum']]
 observations['sensor'] = [s.split(':')[-1] for s in observations['sensor']]
 observations['station'] = [s.split(':')[-1] for s in observations['station']]
-observations['name'] = [get_coops_longname(s) for s in observations['station']]
+# Resolve all the station names at once (and cache them for the later calls).
+names = StationNames.shared().fetch(observations['station'])
+observations['name'] = [names[s] for s in observations['station']]
 
 observations.set_index('name', inplace=True)
 to_html(observations.head(), 'style.css')
@@ -188,7 +194,7 @@ to_html(observations.head(), 'style.css')
 import iris
 from pandas import DataFrame
 from owslib.ows import ExceptionReport
-from utilities import coops2df, save_timeseries
+from utilities import ObservationStore, save_timeseries
 
 iris.FUTURE.netcdf_promote = True
 
@@ -196,17 +202,19 @@ log.info(fmt(' Observations (station data) '))
 fname = '{:%Y-%m-%d}-OBS_DATA.nc'.format(stop)
 
 log.info(fmt(' Downloading to file {} '.format(fname)))
-data = dict()
+# Only the periods not in the local observation store are downloaded, with
+# all the stations requested concurrently over a shared connection pool.
+col = 'water_surface_height_above_reference_datum (m)'
+store = ObservationStore()
+data, errors = store.observations(observations.station, start, stop,
+                                  observed_property=sos_name, column=col,
+                                  datum=datum)
 bad_datum = []
-for station in observations.station:
-    try:
-        df = coops2df(collector, station)
-        col = 'water_surface_height_above_reference_datum (m)'
-        data.update({station: df[col]})
-    except ExceptionReport as e:
+for station, e in errors.items():
+    if isinstance(e, ExceptionReport):
         bad_datum.append(station)
-        name = get_coops_longname(station)
-        log.warning("[{}] {}:\n{}".format(station, name, e))
+    name = get_coops_longname(station)
+    log.warning("[{}] {}:\n{}".format(station, name, e))
 obs_data = DataFrame.from_dict(data)
 
 # Split good and bad vertical datum stations.
@@ -241,85 +249,46 @@ to_html(obs_data.head(), 'style.css')
 get_ipython().magic('matplotlib inline')
 
 import numpy as np
-from iris.pandas import as_series
-from iris.exceptions import (CoordinateNotFoundError, ConstraintMismatchError,
-                             MergeError)
 
-from utilities import (standardize_fill_value, plt_grid, get_cube,
-                       get_model_name, make_tree, get_nearest_water,
-                       add_station, ensure_timeseries)
+from utilities import (plt_grid, extract_model, map_urls, ChunkCache,
+                       GridCache)
 
-# FIXME: Filtering out NECOFS  and estofs.
-dap_urls = [url for url in dap_urls
-            if 'NECOFS' not in url  # cartesian coords are not implemented.
-            if 'estofs' not in url]  # download is taking forver today!
+# FIXME: Filtering out NECOFS, cartesian coords are not implemented.
+dap_urls = [url for url in dap_urls if 'NECOFS' not in url]
 
 
 log.info(fmt(' Models (simulated data) '))
-for k, url in enumerate(dap_urls):
-    with timeit(log):
-        log.info('\n[Reading url {}/{}]: {}'.format(k+1, len(dap_urls), url))
-        try:
-            cube = get_cube(url, name_list=name_list, bbox=bbox,
-                            time=(start, stop), units=iris.unit.Unit('meters'))
-            if cube.ndim == 1:  # We Need a better way to identify model data.
-                log.warning('url {} is probably a timeSeries!'.format(url))
-                continue
-        except (RuntimeError, ValueError, MergeError,
-                ConstraintMismatchError, CoordinateNotFoundError) as e:
-            log.warning('Cannot get cube for: {}\n{}'.format(url, e))
-            continue
-
-        mod_name, model_full_name = get_model_name(cube, url)
-
-        fname = '{:%Y-%m-%d}-{}.nc'.format(stop, mod_name)
-        log.info(fmt(' Downloading to file {} '.format(fname)))
-        try:  # Make tree.
-            tree, lon, lat = make_tree(cube)
-            fig, ax = plt_grid(lon, lat)
-        except CoordinateNotFoundError as e:
-            log.warning('Cannot make KDTree for: {}'.format(mod_name))
-            continue
-        # Get model series at observed locations.
-        raw_series = dict()
-        for station, obs in observations.iterrows():
-            a = obs_data[obs['station']]
-            try:
-                kw = dict(k=10, max_dist=0.04, min_var=0.01)
-                args = cube, tree, obs.lon, obs.lat
-                series, dist, idx = get_nearest_water(*args, **kw)
-            # RuntimeError may occurs, but you should run it again!
-            except ValueError as e:
-                log.warning(e)
-                continue
-            if not series:
-                status = "Found Land"
-            else:
-                raw_series.update({obs['station']: series})
-                series = as_series(series)
-                status = "Found Water"
-                ax.plot(lon[idx], lat[idx], 'g.')
-
-            log.info('[{}] {}'.format(status, obs.name))
-
-        if raw_series:  # Save cube.
-            for station, cube in raw_series.items():
-                cube = standardize_fill_value(cube)
-                cube = add_station(cube, station)
-            try:
-                cube = iris.cube.CubeList(raw_series.values()).merge_cube()
-            except MergeError as e:
-                log.warning(e)
-
-            ensure_timeseries(cube)
-            iris.save(cube, fname)
-            del cube
-
-        size = len(raw_series)
-        ax.set_title('{}: Points found {}'.format(mod_name, size))
-        ax.plot(observations.lon, observations.lat, 'ro',
-                zorder=1, label='Observation', alpha=0.25)
-        ax.set_extent([bbox[0], bbox[2], bbox[1], bbox[3]])
+# Each url is loaded, searched and saved in its own process.  A slow (e.g.
+# estofs) or failing server only loses its own model.  The model data are
+# kept as chunks in `~/.cache/ioos_system_test/model_chunks`, re-runs only
+# download what is not there yet.  The model grids are kept in
+# `~/.cache/ioos_system_test/model_grids`, models without data for the period
+# are skipped before loading them.
+args = observations, name_list, bbox, start, stop
+kw = dict(units=iris.unit.Unit('meters'), cache=ChunkCache(),
+          grids=GridCache())
+done = map_urls(extract_model, dap_urls, args=args, kw=kw, workers=4,
+                timeout=20*60)
+for k, (url, result, error) in enumerate(done):
+    log.info('\n[Read url {}/{}]: {}'.format(k+1, len(dap_urls), url))
+    if error is not None:
+        log.warning('Cannot get cube for: {}\n{}'.format(url, error))
+        continue
+    for level, message in result['messages']:
+        getattr(log, level)(message)
+
+    mod_name, lon, lat = result['mod_name'], result['lon'], result['lat']
+    if result['fname'] is not None:
+        log.info(fmt(' Downloaded to file {} '.format(result['fname'])))
+    fig, ax = plt_grid(lon, lat)
+    for idx in result['found']:
+        ax.plot(lon[idx], lat[idx], 'g.')
+
+    size = len(result['found'])
+    ax.set_title('{}: Points found {}'.format(mod_name, size))
+    ax.plot(observations.lon, observations.lat, 'ro',
+            zorder=1, label='Observation', alpha=0.25)
+    ax.set_extent([bbox[0], bbox[2], bbox[1], bbox[3]])
 
     log.info('[{}]: {}'.format(mod_name, url))
 
@@ -501,6 +470,11 @@ to_html(bias.T, 'style.css')
 
 # In[ ]:
 
+from utilities import coalescer
+
+stats = ' SOS requests: {hits} hits, {misses} misses, {coalesced} coalesced '
+log.info(fmt(stats.format(**coalescer.stats())))
+
 with open(LOG_FILENAME) as f:
     print(''.join(f.readlines()))
 
@@ -0,0 +1,138 @@
+"""
+Benchmark `fetch_observations` against the serial per-station loop (one
+unpooled request per station, as `coops2df` does through the collector)
+using a local mock SOS server that sleeps before every answer.
+
+    python benchmark_sos.py [latency in seconds] [number of stations]
+"""
+
+import sys
+import time
+import threading
+from datetime import datetime, timedelta
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:  # py3k
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import requests
+from io import BytesIO
+from pandas import read_csv
+try:
+    from pandas.testing import assert_frame_equal
+except ImportError:  # Older pandas.
+    from pandas.util.testing import assert_frame_equal
+
+from utilities import fetch_observations
+
+
+HEADER = ('station_id,sensor_id,"latitude (degree)","longitude (degree)",'
+          'date_time,"water_surface_height_above_reference_datum (m)",'
+          'datum_id,"vertical_position (m)"\n')
+
+EXCEPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1" version="1.0.0">
+  <ows:Exception exceptionCode="InvalidParameterValue" locator="result">
+    <ows:ExceptionText>No data for the requested datum</ows:ExceptionText>
+  </ows:Exception>
+</ows:ExceptionReport>
+"""
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def mock_sos(latency, points=240, port=0):
+    """Start a mock CO-OPS SOS in a thread and return its url.  Stations
+    whose id ends in 9 answer with an ExceptionReport."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, so pooling pays off.
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            station = query['offering'][0].split(':')[-1]
+            time.sleep(latency)
+            if station.endswith('9'):
+                body, content_type = EXCEPTION, 'text/xml'
+            else:
+                t0 = datetime(2015, 1, 1)
+                rows = ['urn:ioos:station:NOAA.NOS.CO-OPS:{0},'
+                        'urn:ioos:sensor:NOAA.NOS.CO-OPS:{0}:A1,30.0,-80.0,'
+                        '{1:%Y-%m-%dT%H:%M:%SZ},{2:.3f},'
+                        'urn:ogc:def:datum:epsg::5103,0.0\n'.format(
+                            station, t0 + timedelta(minutes=6 * k),
+                            k / 1000.) for k in range(points)]
+                body, content_type = HEADER + ''.join(rows), 'text/csv'
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadedHTTPServer(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d/ioos-dif-sos/SOS' % server.server_address[1]
+
+
+def serial_observations(url, stations, start, stop):
+    """One new connection per station, like the collector loop."""
+    data = dict()
+    for station in stations:
+        params = dict(service='SOS', request='GetObservation',
+                      version='1.0.0', responseFormat='text/csv',
+                      observedProperty='water_surface_height_above_reference_datum',
+                      offering='urn:ioos:station:NOAA.NOS.CO-OPS:%s' % station,
+                      eventTime='%s/%s' % (start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                           stop.strftime('%Y-%m-%dT%H:%M:%SZ')),
+                      result='VerticalDatum==urn:ogc:def:datum:epsg::5103')
+        r = requests.get(url, params=params)
+        if 'csv' in r.headers['Content-Type']:
+            df = read_csv(BytesIO(r.content), parse_dates=True,
+                          index_col='date_time')
+            if getattr(df.index, 'tz', None) is not None:
+                # Newer pandas keep the UTC of the 'Z' suffix, while
+                # `read_sos_csv` returns naive UTC times like older pandas.
+                df.index = df.index.tz_convert(None)
+            data[station] = df
+    return data
+
+
+if __name__ == '__main__':
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+    url = mock_sos(latency)
+    stations = [str(8410000 + k) for k in range(n)]
+    start, stop = datetime(2015, 1, 1), datetime(2015, 1, 2)
+
+    t0 = time.time()
+    serial = serial_observations(url, stations, start, stop)
+    serial_time = time.time() - t0
+
+    t0 = time.time()
+    data, errors = fetch_observations(stations, start, stop, url=url,
+                                      workers=8)
+    concurrent_time = time.time() - t0
+
+    assert sorted(serial) == sorted(data)
+    assert all(s.endswith('9') for s in errors)
+    for station, df in serial.items():
+        assert_frame_equal(df, data[station])
+
+    print('%d stations (%d with errors), %.2fs latency each' %
+          (n, len(errors), latency))
+    print('serial:     %6.2fs' % serial_time)
+    print('concurrent: %6.2fs (%.1fx)' % (concurrent_time,
+                                          serial_time / concurrent_time))
@@ -1,29 +1,50 @@
 # Standard Library.
+import os
+import sys
+import copy
+import json
 import time
+import hashlib
+import itertools
 import warnings
 import contextlib
+import threading
+import multiprocessing
+from collections import OrderedDict, defaultdict
 from io import BytesIO
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 
 try:
-    from urllib import urlopen
     from urlparse import urlparse
 except ImportError:  # py3k
     from urllib.parse import urlparse
-    from urllib.request import urlopen
+try:
+    from Queue import Empty
+except ImportError:  # py3k
+    from queue import Empty
 
 # Scientific stack.
 import numpy as np
 import numpy.ma as ma
 from owslib import fes
+from owslib.ows import ExceptionReport
+try:
+    from owslib.catalogue.csw2 import CatalogueServiceWeb
+except ImportError:  # Older OWSLib.
+    from owslib.csw import CatalogueServiceWeb
 import matplotlib.pyplot as plt
 from scipy.spatial import KDTree
-from pandas import read_csv
+from pandas import (DataFrame, Series, Timestamp, concat, read_csv,
+                    to_datetime)
+from netCDF4 import Dataset, date2num
 
 import iris
+import biggus
 from iris.cube import CubeList
 from iris.pandas import as_cube, as_data_frame
-from iris.exceptions import CoordinateNotFoundError, CoordinateMultiDimError
+from iris.exceptions import (CoordinateNotFoundError, CoordinateMultiDimError,
+                             MergeError)
 
 iris.FUTURE.netcdf_promote = True
 iris.FUTURE.cell_datetime_objects = True
@@ -38,6 +59,15 @@ from IPython.display import HTML
 
 from oceans import wrap_lon180
 
+# The station long names and the service URN normalization are shared with
+# the other notebooks, see station_names.py and csw_records.py at the top of
+# the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+from csw_records import service_mapping, normalize_service_urn  # noqa
+from csw_records import ServiceIndex, iter_pages  # noqa
+
 water_level = ['sea_surface_height',
                'sea_surface_elevation',
                'sea_surface_height_above_geoid',
@@ -178,8 +208,99 @@ def intersection(cube, bbox):
     return cube
 
 
+def _widen(indices, size):
+    """Slice from the first to the last of `indices`, plus one point on each
+    side (trimmed later by `intersection` and `time_slice`)."""
+    return slice(int(max(indices.min() - 1, 0)),
+                 int(min(indices.max() + 2, size)))
+
+
+def cube_grid(cube):
+    """The coordinates of `cube` as in `GridCache.grid`: longitudes wrapped to
+    -180/180, latitudes, time axis and the cube dimensions of each axis."""
+    lon, lat = cube.coord(axis='X'), cube.coord(axis='Y')
+    grid = dict(lon=wrap_lon180(lon.points), lat=lat.points,
+                dims=dict(X=list(cube.coord_dims(lon)),
+                          Y=list(cube.coord_dims(lat))))
+    try:
+        timevar = time_coord(cube)
+    except CoordinateNotFoundError:
+        return grid
+    grid['dims']['T'] = list(cube.coord_dims(timevar))
+    grid.update(time=timevar.points, time_units=str(timevar.units),
+                calendar=timevar.units.calendar or 'standard')
+    return grid
+
+
+def grid_fits(grid, cube):
+    """Whether the arrays of `grid` match the dimensions of `cube`."""
+    for axis, key in (('X', 'lon'), ('Y', 'lat'), ('T', 'time')):
+        dims = grid['dims'].get(axis)
+        if key not in grid or dims is None:
+            continue
+        if (max(dims) >= cube.ndim or
+                np.shape(grid[key]) != tuple(cube.shape[d] for d in dims)):
+            return False
+    return True
+
+
+def subset_slices(cube, bbox=None, start=None, stop=None, grid=None):
+    """Index the `cube` dimensions covering the `bbox` and the [start, stop]
+    period, found from the coordinate points alone (no data is read).  The
+    coordinates come from `grid` (see `GridCache`) when it fits the cube.
+
+    Handles 1D and 2D longitude/latitude, and 0-360 longitudes.  Dimensions
+    that cannot be narrowed (e.g. unstructured grids) are kept whole."""
+    if grid is None or not grid_fits(grid, cube):
+        grid = cube_grid(cube)
+    keys = [slice(None)] * cube.ndim
+    dims = grid['dims']
+    if start is not None and 'time' in grid and len(dims.get('T', [])) == 1:
+        points = grid['time']
+        t0, t1 = date2num([start, stop or start], grid['time_units'],
+                          calendar=grid['calendar'])
+        inside = np.where((points >= t0) & (points <= t1))[0]
+        if not inside.size:  # Just the nearest point(s).
+            inside = np.array([np.abs(points - t0).argmin(),
+                               np.abs(points - t1).argmin()])
+        keys[dims['T'][0]] = _widen(inside, len(points))
+    if bbox is not None:
+        lon_dims, lat_dims = dims.get('X', []), dims.get('Y', [])
+        x, y = grid['lon'], grid['lat']
+        if (len(lon_dims) == 1 and len(lat_dims) == 1 and
+                lon_dims != lat_dims):
+            # Across the 0/360 seam both ends are inside: kept whole.
+            inside = np.where((x >= bbox[0]) & (x <= bbox[2]))[0]
+            if not inside.size:
+                raise ValueError('No longitudes in {!r}'.format(bbox))
+            keys[lon_dims[0]] = _widen(inside, len(x))
+            inside = np.where((y >= bbox[1]) & (y <= bbox[3]))[0]
+            if not inside.size:
+                raise ValueError('No latitudes in {!r}'.format(bbox))
+            keys[lat_dims[0]] = _widen(inside, len(y))
+        elif len(lon_dims) == 2 and lon_dims == lat_dims:
+            inregion = ((x >= bbox[0]) & (x <= bbox[2]) &
+                        (y >= bbox[1]) & (y <= bbox[3]))
+            rows, cols = np.where(inregion)
+            if not rows.size:
+                raise ValueError('No points in {!r}'.format(bbox))
+            keys[lon_dims[0]] = _widen(rows, x.shape[0])
+            keys[lon_dims[1]] = _widen(cols, x.shape[1])
+    return tuple(keys)
+
+
 def get_cube(url, name_list=None, bbox=None, callback=None,
-             time=None, units=None, constraint=None):
+             time=None, units=None, constraint=None, subset_first=True,
+             cache=None, grid=None):
+    """Load the cube of `url` matching `name_list` for the `bbox` and `time`
+    (start or (start, stop)).
+
+    With `subset_first` the lazy cube is narrowed to the index window of the
+    `bbox` and the period, found from the coordinates (`subset_slices`),
+    before the exact subsetting.  No data is read here: the station series
+    are read later in a few hyperslabs, see `nearest_water_batch`.  With a
+    `ChunkCache` as `cache` the data are read through it, and the index
+    window is found from the cached `grid` (see `GridCache`) when given."""
     cubes = iris.load_raw(url, callback=callback)
     if constraint:
         cubes = cubes.extract(constraint)
@@ -190,8 +311,9 @@ def get_cube(url, name_list=None, bbox=None, callback=None,
             raise ValueError('Cube does not contain {!r}'.format(name_list))
         else:
             cube = cubes.merge_cube()
-    if bbox:
-        cube = intersection(cube, bbox)
+    if cache is not None:
+        cache.cache_cube(cube, url)
+    start = stop = None
     if time:
         if isinstance(time, datetime):
             start, stop = time, None
@@ -200,6 +322,11 @@ def get_cube(url, name_list=None, bbox=None, callback=None,
         else:
             raise ValueError('Time must be start or (start, stop).'
                              '  Got {!r}'.format(time))
+    if subset_first and (bbox or time):
+        cube = cube[subset_slices(cube, bbox, start, stop, grid=grid)]
+    if bbox:
+        cube = intersection(cube, bbox)
+    if time:
         cube = time_slice(cube, start, stop)
     if units:
         if not cube.units == units:
@@ -318,12 +445,17 @@ def get_model_name(cube, url):
     return mod_name, model_full_name
 
 
-def make_tree(cube):
-    """Create KDTree."""
-    lon = cube.coord(axis='X').points
-    lat = cube.coord(axis='Y').points
-    # FIXME: Not sure if it is need when using `iris.intersect()`.
-    lon = wrap_lon180(lon)
+def make_tree(cube, grid=None):
+    """Create KDTree.  The wrapped coordinates of an unstructured `grid` (see
+    `GridCache`) are used when they match the cube."""
+    if (grid is not None and grid.get('topology') == 'unstructured' and
+            grid['lon'].shape == cube.coord(axis='X').shape):
+        lon, lat = grid['lon'], grid['lat']
+    else:
+        lon = cube.coord(axis='X').points
+        lat = cube.coord(axis='Y').points
+        # FIXME: Not sure if it is need when using `iris.intersect()`.
+        lon = wrap_lon180(lon)
     # Structured models with 1D lon, lat.
     if (lon.ndim == 1) and (lat.ndim == 1) and (cube.ndim == 3):
         lon, lat = np.meshgrid(lon, lat)
@@ -332,10 +464,10 @@ def make_tree(cube):
     return tree, lon, lat
 
 
-def get_nearest_water(cube, tree, xi, yi, k=10, max_dist=0.04, min_var=0.01):
-    """Find `k` nearest model data points from an iris `cube` at station
-    lon=`xi`, lat=`yi` up to `max_dist` in degrees.  Must provide a Scipy's
-    KDTree `tree`."""
+def nearest_candidates(cube, tree, xi, yi, k=10, max_dist=0.04):
+    """The grid indices and distances of the `k` nearest model data points
+    from an iris `cube` at station lon=`xi`, lat=`yi` up to `max_dist` in
+    degrees, closest first.  Must provide a Scipy's KDTree `tree`."""
     # TODO: pykdtree might be faster, but would introduce another dependency.
     # Scipy is more likely to be already installed.  Still, this function could
     # be generalized to accept pykdtree tree object.
@@ -353,25 +485,26 @@ def get_nearest_water(cube, tree, xi, yi, k=10, max_dist=0.04, min_var=0.01):
                          (xi, yi, max_dist))
     # Unstructured model.
     if (cube.coord(axis='X').ndim == 1) and (cube.ndim == 2):
-        i = j = indices
-        unstructured = True
+        return [(dist, (idx,)) for dist, idx in zip(distances, indices)]
     # Structured model.
+    if cube.coord(axis='X').ndim == 2:  # CoordinateMultiDim
+        i, j = np.unravel_index(indices, cube.coord(axis='X').shape)
     else:
-        unstructured = False
-        if cube.coord(axis='X').ndim == 2:  # CoordinateMultiDim
-            i, j = np.unravel_index(indices, cube.coord(axis='X').shape)
-        else:
-            shape = (cube.coord(axis='Y').shape[0],
-                     cube.coord(axis='X').shape[0])
-            i, j = np.unravel_index(indices, shape)
+        shape = (cube.coord(axis='Y').shape[0],
+                 cube.coord(axis='X').shape[0])
+        i, j = np.unravel_index(indices, shape)
+    return list(zip(distances, zip(i, j)))
+
+
+def _first_water(cube, candidates, min_var, read):
+    """Walk the `candidates` as `get_nearest_water` does, reading each
+    series with `read(idx)`."""
     # Use only data where the standard deviation of the time series exceeds
     # 0.01 m (1 cm) this eliminates flat line model time series that come from
     # land points that should have had missing values.
     series, dist, idx = None, None, None
-    for dist, idx in zip(distances, zip(i, j)):
-        if unstructured:  # NOTE: This would be so elegant in py3k!
-            idx = (idx[0],)
-        series = cube[(slice(None),)+idx]
+    for dist, idx in candidates:
+        series = read(idx)
         # Accounting for wet-and-dry models.
         arr = ma.masked_invalid(series.data).filled(fill_value=0)
         if arr.std() <= min_var:
@@ -380,6 +513,211 @@ def get_nearest_water(cube, tree, xi, yi, k=10, max_dist=0.04, min_var=0.01):
     return series, dist, idx
 
 
+def get_nearest_water(cube, tree, xi, yi, k=10, max_dist=0.04, min_var=0.01):
+    """Find `k` nearest model data points from an iris `cube` at station
+    lon=`xi`, lat=`yi` up to `max_dist` in degrees.  Must provide a Scipy's
+    KDTree `tree`."""
+    candidates = nearest_candidates(cube, tree, xi, yi, k=k,
+                                    max_dist=max_dist)
+    return _first_water(cube, candidates, min_var,
+                        lambda idx: cube[(slice(None),)+idx])
+
+
+def hyperslabs(indices, block=32):
+    """Group grid `indices` (tuples) into rectangular hyperslabs, one per
+    `block` wide tile of the grid (`block`**2 for unstructured grids) that
+    has points, spanning the points in it.  Returns {tile: (start, stop)}
+    and the tile of each index."""
+    if indices and len(indices[0]) == 1:
+        block = block ** 2
+    tiles = defaultdict(set)
+    for idx in indices:
+        tiles[tuple(i // block for i in idx)].add(idx)
+    slabs = dict()
+    for tile, points in tiles.items():
+        points = np.array(sorted(points))
+        slabs[tile] = (tuple(points.min(axis=0)),
+                       tuple(points.max(axis=0) + 1))
+    return slabs, lambda idx: tuple(i // block for i in idx)
+
+
+def nearest_water_batch(cube, tree, points, k=10, max_dist=0.04,
+                        min_var=0.01, block=32, workers=1):
+    """`get_nearest_water` for many stations, {key: (lon, lat)}, at once.
+
+    The candidate points of all the stations are grouped into `hyperslabs`
+    and each slab is read with a single request (`workers` at a time), so
+    neighbouring stations share requests instead of reading one series per
+    candidate.  Returns {key: (series, dist, idx)} and {key: error} for the
+    stations without data."""
+    candidates, errors = dict(), dict()
+    for key, (xi, yi) in points.items():
+        try:
+            candidates[key] = nearest_candidates(cube, tree, xi, yi, k=k,
+                                                 max_dist=max_dist)
+        except ValueError as e:
+            errors[key] = e
+    indices = sorted(set(idx for found in candidates.values()
+                         for dist, idx in found))
+    slabs, tile_of = hyperslabs(indices, block=block)
+
+    def read_slab(tile):
+        start, stop = slabs[tile]
+        keys = tuple(slice(i0, i1) for i0, i1 in zip(start, stop))
+        return tile, cube[(slice(None),)+keys].data
+
+    if workers > 1 and len(slabs) > 1:
+        # NOTE: Only if the netCDF library is thread safe.
+        pool = ThreadPool(min(workers, len(slabs)))
+        try:
+            data = dict(pool.map(read_slab, list(slabs)))
+        finally:
+            pool.close()
+    else:
+        data = dict(read_slab(tile) for tile in slabs)
+
+    def read(idx):
+        tile = tile_of(idx)
+        start = slabs[tile][0]
+        offset = tuple(i - i0 for i, i0 in zip(idx, start))
+        series = cube[(slice(None),)+idx]  # Lazy, not read.
+        series.data = data[tile][(slice(None),)+offset]
+        return series
+
+    nearest = dict((key, _first_water(cube, found, min_var, read))
+                   for key, found in candidates.items())
+    return nearest, errors
+
+
+def extract_model(url, observations, name_list, bbox, start, stop,
+                  units=None, k=10, max_dist=0.04, min_var=0.01, cache=None,
+                  grids=None):
+    """Load the model at `url` and save its series nearest to each of the
+    `observations` (station, lon, lat) to `{stop:%Y-%m-%d}-{mod_name}.nc`.
+
+    Returns a dict with the model name, the file name (None when no station
+    was found in water and nothing was saved), the model grid, the grid
+    indices found in water and the log messages as (level, message).
+    With a `GridCache` as `grids` models without data in the period are
+    skipped before loading them, and the cached grid is used to subset the
+    model and to build the KDTree."""
+    t = time.time()
+    grid = None
+    if grids is not None:
+        grid = grids.grid(url, name_list)
+        if not grid_covers(grid, start, stop):
+            raise ValueError('No model data between {} and {} at {}'.format(
+                start, stop, url))
+    cube = get_cube(url, name_list=name_list, bbox=bbox, time=(start, stop),
+                    units=units, cache=cache, grid=grid)
+    if cube.ndim == 1:  # We Need a better way to identify model data.
+        raise ValueError('url {} is probably a timeSeries!'.format(url))
+    mod_name, model_full_name = get_model_name(cube, url)
+    fname = None
+    tree, lon, lat = make_tree(cube, grid=grid)
+
+    messages, found, raw_series = [], [], dict()
+    points = dict((station, (obs.lon, obs.lat))
+                  for station, obs in observations.iterrows())
+    if cube.has_lazy_data():  # Read all the stations in a few hyperslabs.
+        nearest, errors = nearest_water_batch(cube, tree, points, k=k,
+                                              max_dist=max_dist,
+                                              min_var=min_var)
+    else:
+        nearest, errors = dict(), dict()
+        for station, (xi, yi) in points.items():
+            try:
+                nearest[station] = get_nearest_water(cube, tree, xi, yi, k=k,
+                                                     max_dist=max_dist,
+                                                     min_var=min_var)
+            except ValueError as e:
+                errors[station] = e
+    for station, obs in observations.iterrows():
+        if station in errors:
+            messages.append(('warning', str(errors[station])))
+            continue
+        series, dist, idx = nearest[station]
+        if not series:
+            status = "Found Land"
+        else:
+            raw_series.update({obs['station']: series})
+            found.append(idx)
+            status = "Found Water"
+        messages.append(('info', '[{}] {}'.format(status, obs.name)))
+
+    if raw_series:  # Save cube.
+        for station, cube in raw_series.items():
+            cube = standardize_fill_value(cube)
+            cube = add_station(cube, station)
+        try:
+            cube = CubeList(raw_series.values()).merge_cube()
+        except MergeError as e:
+            messages.append(('warning', str(e)))
+        ensure_timeseries(cube)
+        fname = '{:%Y-%m-%d}-{}.nc'.format(stop, mod_name)
+        iris.save(cube, fname)
+    elapsed = time.strftime("%H:%M:%S", time.gmtime(time.time()-t))
+    messages.append(('info', elapsed))
+    return dict(mod_name=mod_name, model_full_name=model_full_name,
+                fname=fname, lon=lon, lat=lat, found=found,
+                messages=messages)
+
+
+def _map_url(queue, key, func, url, args, kw):
+    try:
+        queue.put((key, func(url, *args, **kw), None))
+    except Exception as e:
+        queue.put((key, None, '{}: {}'.format(type(e).__name__, e)))
+
+
+def map_urls(func, urls, args=(), kw=None, workers=4, timeout=20*60):
+    """Call `func(url, *args, **kw)` for each of `urls`, each in its own
+    process, `workers` at a time.
+
+    Yields (url, result, error) as each call completes.  The error is a
+    string, so a failing or crashing url does not stop the others, and a
+    call running longer than `timeout` seconds is terminated.  `func` and
+    its result must be picklable, or `func` defined at import time.  The
+    calls still running are terminated when the generator is closed."""
+    kw = kw or dict()
+    queue = multiprocessing.Queue()
+    pending = list(enumerate(urls))
+    running = dict()
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                key, url = pending.pop(0)
+                process = multiprocessing.Process(target=_map_url,
+                                                  args=(queue, key, func, url,
+                                                        args, kw))
+                process.daemon = True
+                process.start()
+                running[key] = (url, process, time.time())
+            try:
+                key, result, error = queue.get(timeout=1)
+            except Empty:
+                pass
+            else:
+                url, process, started = running.pop(key)
+                process.join()
+                yield url, result, error
+            for key, (url, process, started) in list(running.items()):
+                if time.time() - started > timeout:
+                    error = 'Timed out after {} s'.format(timeout)
+                elif process.exitcode not in (None, 0):
+                    error = 'Exited with code {}'.format(process.exitcode)
+                else:
+                    continue
+                process.terminate()
+                process.join()
+                del running[key]
+                yield url, None, error
+    finally:  # The consumer stopped early (e.g. KeyboardInterrupt).
+        for url, process, started in running.values():
+            process.terminate()
+            process.join()
+
+
 # OWS/PYOOS.
 def fes_date_filter(start, stop, constraint='overlaps'):
     """Take datetime-like objects and returns a fes filter for date range.
@@ -406,7 +744,8 @@ def fes_date_filter(start, stop, constraint='overlaps'):
 
 
 def service_urls(records, service='odp:url'):
-    """Extract service_urls of a specific type (DAP, SOS) from records."""
+    """Extract service_urls of a specific type (DAP, SOS) from records.
+    Works on a full `csw.records` or on each page from `iter_pages`."""
     service_string = 'urn:x-esri:specification:ServiceType:' + service
     urls = []
     for key, rec in records.items():
@@ -420,6 +759,180 @@ def service_urls(records, service='odp:url'):
     return urls
 
 
+class CachedCatalogueServiceWeb(CatalogueServiceWeb):
+    """A `CatalogueServiceWeb` that keeps the GetCapabilities and GetRecords
+    responses in a `DiskCache`.  The GetRecords key is the endpoint plus the
+    canonical (C14N) GetRecords document, which holds the filters, `esn`,
+    `maxrecords`, etc.
+
+    If the endpoint is down an expired entry is served instead, with a
+    warning.  With `offline=True` the network is never used; without cached
+    capabilities GetRecords then goes to `url`.  Otherwise it is POSTed to
+    the operation URL advertised in the capabilities."""
+    def __init__(self, url, cache=None, offline=False, **kw):
+        self.cache = DiskCache('csw') if cache is None else cache
+        self.offline = offline
+        try:
+            super(CachedCatalogueServiceWeb, self).__init__(url, **kw)
+        except ValueError:
+            if not offline:
+                raise
+            super(CachedCatalogueServiceWeb, self).__init__(
+                url, skip_caps=True, **kw)
+
+    def operation_url(self, name, method='Post'):
+        """The URL advertised for operation `name` and HTTP `method`."""
+        for operation in getattr(self, 'operations', None) or []:
+            if operation.name != name:
+                continue
+            for verb in operation.methods:
+                if verb.get('type', '').lower() == method.lower():
+                    return verb.get('url')
+        return None
+
+    def _invoke_at(self, operation):
+        """OWSLib's `_invoke` sent to the URL of `operation`.  OWSLib looks
+        the URL up from the name of the calling method, which is `_invoke`
+        here, so it would always use `url`."""
+        url = self.url
+        if operation:
+            self.url = self.operation_url(operation) or url
+        try:
+            super(CachedCatalogueServiceWeb, self)._invoke()
+        finally:
+            self.url = url
+
+    def _invoke(self):
+        if not hasattr(self.request, 'tag'):  # GET KVP.
+            if 'GetCapabilities' not in self.request:
+                return self._invoke_at(None)
+            request = self.request
+            key = '{}\n{}'.format(self.url, request).encode('utf-8')
+            return self._cached(key, request, None)
+        if not self.request.tag.endswith('GetRecords'):
+            return self._invoke_at(etree.QName(self.request).localname)
+        # OWSLib declares every namespace it knows about, some of them with
+        # relative URIs that C14N refuses to serialize.  Drop the unused ones.
+        request = copy.deepcopy(self.request)
+        etree.cleanup_namespaces(request)
+        request = etree.tostring(request, method='c14n')
+        key = self.url.encode('utf-8') + b'\n' + request
+        return self._cached(key, request, 'GetRecords')
+
+    def _cached(self, key, request, operation):
+        response = self.cache.get(key)
+        if response is None and not self.offline:
+            try:
+                self._invoke_at(operation)
+            except Exception as e:
+                response = self.cache.get(key, stale=True)
+                if response is None:
+                    raise
+                warnings.warn('{} is unreachable ({}), using a stale '
+                              'cached response.'.format(self.url, e))
+            else:
+                self.cache.set(key, self.response)
+                return
+        elif response is None:
+            response = self.cache.get(key, stale=True)
+            if response is None:
+                raise ValueError('No cached response for this request and '
+                                 'offline mode is on.')
+        self.request = request
+        self.response = response
+        self._exml = etree.parse(BytesIO(self.response))
+        self.exceptionreport = None
+
+
+class RequestCoalescer(object):
+    """Memoize requests by key and share a request in flight.
+
+    The first call for a key (a miss) makes the request, calls for the same
+    key while it is in flight wait for it (coalesced) and later calls reuse
+    its result (hits).  Failed requests are not kept, the next call retries.
+    At most `maxsize` results are kept, for `ttl` seconds, least recently
+    used first out.  DataFrames and Series are returned as copies, other
+    results (e.g. `requests` responses) are shared and must not be
+    modified.  See `stats` for the counts."""
+    def __init__(self, maxsize=256, ttl=60*60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = self.misses = self.coalesced = 0
+
+    def _expired(self, entry):
+        return (entry['done'].is_set() and
+                time.time() - entry['time'] > self.ttl)
+
+    def _evict(self):
+        """Drop the least recently used results beyond `maxsize` (the
+        requests in flight are kept)."""
+        done = [key for key, entry in self._entries.items()
+                if entry['done'].is_set()]
+        for key in done[:max(0, len(done) - self.maxsize)]:
+            del self._entries[key]
+
+    def call(self, key, func, *args, **kw):
+        """Return `func(*args, **kw)`, requested once per `key`."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or self._expired(entry):
+                entry = dict(done=threading.Event())
+                self.misses += 1
+                owner = True
+            else:
+                if entry['done'].is_set():
+                    self.hits += 1
+                else:
+                    self.coalesced += 1
+                owner = False
+            self._entries[key] = entry  # Most recently used last.
+        if owner:
+            try:
+                entry['result'] = func(*args, **kw)
+            except Exception as e:
+                entry['error'] = e
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+            finally:
+                entry['time'] = time.time()
+                entry['done'].set()
+                with self._lock:
+                    self._evict()
+        entry['done'].wait()
+        if 'error' in entry:
+            raise entry['error']
+        result = entry['result']
+        if isinstance(result, (DataFrame, Series)):
+            result = result.copy()
+        return result
+
+    def get(self, url, params=None, session=None, **kw):
+        """Coalesced `requests.get` (raising for HTTP errors)."""
+        r = requests.Request('GET', url, params=params).prepare()
+
+        def get():
+            response = (session or requests).get(r.url, **kw)
+            response.raise_for_status()
+            return response
+        return self.call(r.url, get)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    coalesced=self.coalesced)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by the SOS requests of this module.
+coalescer = RequestCoalescer()
+StationNames.shared(get=coalescer.get)
+
+
 def sos_request(url='opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS', **kw):
     url = parse_url(url)
     offering = 'urn:ioos:network:NOAA.NOS.CO-OPS:CurrentsActive'
@@ -429,8 +942,7 @@ def sos_request(url='opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS', **kw):
                   offering=offering,
                   responseFormat='text/csv')
     params.update(kw)
-    r = requests.get(url, params=params)
-    r.raise_for_status()
+    r = coalescer.get(url, params=params)
     content = r.headers['Content-Type']
     if 'excel' in content or 'csv' in content:
         return r.url
@@ -440,20 +952,8 @@ def sos_request(url='opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS', **kw):
 
 def get_coops_longname(station):
     """Get longName for specific station from COOPS SOS using DescribeSensor
-    request."""
-    url = ('opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?service=SOS&'
-           'request=DescribeSensor&version=1.0.0&'
-           'outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-           'procedure=urn:ioos:station:NOAA.NOS.CO-OPS:%s') % station
-    url = parse_url(url)
-    tree = etree.parse(urlopen(url))
-    root = tree.getroot()
-    path = "//sml:identifier[@name='longName']/sml:Term/sml:value/text()"
-    namespaces = dict(sml="http://www.opengis.net/sensorML/1.0.1")
-    longName = root.xpath(path, namespaces=namespaces)
-    if len(longName) == 0:
-        longName = station
-    return longName[0]
+    request.  See `StationNames`."""
+    return StationNames.shared().get(station)
 
 
 def coops2df(collector, coops_id):
@@ -467,6 +967,114 @@ def coops2df(collector, coops_id):
     return data_df
 
 
+def read_sos_csv(stream, columns=None, float32=False, chunksize=50000):
+    """Parse a SOS text/csv response straight from the file-like `stream`
+    (e.g. the `raw` of a streamed `requests` response), `chunksize` rows at
+    a time.
+
+    The `date_time` column is parsed with the fixed ISO 8601 format of the
+    SOS (falling back to inference only when it does not match) and becomes
+    the index.  Only the `columns` requested are kept and, with `float32`,
+    the float columns are downcast as each chunk is read."""
+    usecols = None if columns is None else ['date_time'] + list(columns)
+    chunks = []
+    for chunk in read_csv(stream, usecols=usecols, chunksize=chunksize):
+        date_time = chunk.pop('date_time')
+        try:
+            index = to_datetime(date_time, format='%Y-%m-%dT%H:%M:%SZ')
+        except ValueError:
+            index = to_datetime(date_time)
+        chunk.index = index.values
+        if float32:
+            floats = chunk.select_dtypes(include=[np.float64]).columns
+            for column in floats:
+                chunk[column] = chunk[column].astype(np.float32)
+        chunks.append(chunk)
+    if not chunks:
+        return DataFrame(columns=columns)
+    df = chunks[0] if len(chunks) == 1 else concat(chunks)
+    df.index.name = 'date_time'
+    return df
+
+
+def sos_session(workers=8):
+    """A `requests.Session` keeping up to `workers` connections per host."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                            pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_observations(stations, start, stop,
+                       observed_property='water_surface_height_above_reference_datum',
+                       datum='NAVD', workers=8, session=None, timeout=120,
+                       url='opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS',
+                       columns=None, float32=False):
+    """CSV GetObservation of each CO-OPS station in `stations` between the
+    datetimes `start` and `stop`, issued `workers` at a time over one pooled
+    `requests.Session` (no shared collector).  The responses are parsed as
+    they stream in by `read_sos_csv` (see there for `columns` and
+    `float32`).
+
+    Returns a dict of {station: DataFrame} and a dict of {station: exception}
+    for the stations that failed (an `ExceptionReport` when the server
+    rejected the request, e.g. no data in the requested datum).  Identical
+    requests are made once, see `coalescer`."""
+    if datum == 'NAVD':
+        datum = 'urn:ogc:def:datum:epsg::5103'
+    elif datum is not None:
+        datum = 'urn:ioos:def:datum:noaa::{}'.format(datum)
+    event_time = '{:%Y-%m-%dT%H:%M:%SZ}/{:%Y-%m-%dT%H:%M:%SZ}'.format(start,
+                                                                    stop)
+    if session is None:
+        session = sos_session(workers)
+    url = parse_url(url)
+
+    def get_observation(station):
+        params = dict(service='SOS', request='GetObservation',
+                      version='1.0.0', responseFormat='text/csv',
+                      observedProperty=observed_property,
+                      offering='urn:ioos:station:NOAA.NOS.CO-OPS:{}'.format(
+                          station),
+                      eventTime=event_time)
+        if datum is not None:
+            params['result'] = 'VerticalDatum=={}'.format(datum)
+
+        def read():
+            r = session.get(url, params=params, timeout=timeout, stream=True)
+            with contextlib.closing(r):
+                r.raise_for_status()
+                if 'csv' not in r.headers.get('Content-Type', ''):
+                    root = etree.fromstring(r.content)
+                    raise ExceptionReport(root, etree.QName(root).namespace)
+                r.raw.decode_content = True
+                return read_sos_csv(r.raw, columns=columns, float32=float32)
+
+        key = (requests.Request('GET', url, params=params).prepare().url,
+               tuple(columns or []), float32)
+        try:
+            return station, coalescer.call(key, read), None
+        except Exception as e:
+            return station, None, e
+
+    data, errors = dict(), dict()
+    stations = list(stations)
+    if stations:
+        pool = ThreadPool(min(workers, len(stations)))
+        try:
+            for station, df, error in pool.imap_unordered(get_observation,
+                                                          stations):
+                if error is None:
+                    data[station] = df
+                else:
+                    errors[station] = error
+        finally:
+            pool.close()
+    return data, errors
+
+
 def nc2df(fname):
     cube = iris.load_cube(fname)
     for coord in cube.coords(dimensions=[0]):
@@ -540,6 +1148,593 @@ def get_coordinates(bbox):
     return coordinates
 
 
+# Caching.
+cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ioos_system_test')
+
+
+class DiskCache(object):
+    """Content-addressed cache of byte strings under `cache_dir/name`.
+
+    Entries older than `ttl` seconds are expired but kept around, so they
+    can still be requested with `stale=True` (e.g. when a server is down).
+    When the cache grows past `max_bytes` the least recently used entries
+    are evicted.  The file modification time is when the entry was stored,
+    the access time is when it was last used."""
+    def __init__(self, name, ttl=24*60*60, max_bytes=200*1024**2,
+                 path=None):
+        self.path = os.path.join(path or cache_dir, name)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def fname(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+    def get(self, key, stale=False):
+        """Return the cached bytes for `key` or None."""
+        fname = self.fname(key)
+        try:
+            mtime = os.path.getmtime(fname)
+            if not stale and time.time() - mtime > self.ttl:
+                return None
+            with open(fname, 'rb') as f:
+                content = f.read()
+        except (IOError, OSError):
+            return None
+        os.utime(fname, (time.time(), mtime))
+        return content
+
+    def set(self, key, content, evict=True):
+        """Store `content` for `key`.  With `evict=False` the caller is
+        expected to call `evict` once after a batch of `set`."""
+        fname = self.fname(key)
+        tmp = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        if os.path.exists(fname):  # Windows cannot rename over a file.
+            os.remove(fname)
+        os.rename(tmp, fname)
+        if evict:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for atime, nbytes, name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+
+
+def _seconds(t):
+    """Seconds since 1970-01-01 of the (naive or UTC) datetime `t`."""
+    t = Timestamp(t)
+    if t.tzinfo is not None:
+        t = t.tz_convert('UTC').tz_localize(None)
+    return t.value / 1e9
+
+
+def _merge_intervals(intervals):
+    """Sort and merge the overlapping (or touching) (start, stop) pairs."""
+    merged = []
+    for start, stop in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(interval) for interval in merged]
+
+
+def _subtract_intervals(start, stop, intervals):
+    """The parts of [start, stop] not in the merged `intervals`."""
+    missing = []
+    for t0, t1 in intervals:
+        if t1 < start or t0 > stop:
+            continue
+        if t0 > start:
+            missing.append((start, t0))
+        start = max(start, t1)
+    if start < stop:
+        missing.append((start, stop))
+    return missing
+
+
+class ObservationStore(object):
+    """Local store of the station time series downloaded from the SOS
+    servers, one netCDF file per (provider, station, variable, datum) under
+    `cache_dir/observations`.
+
+    Each file holds the samples and the time intervals already requested,
+    so `observations` only fetches the parts of [start, stop] that are
+    missing and serves the rest from disk.  The last `margin` seconds before
+    now are never marked as covered, so the samples published late and the
+    preliminary data revised later are requested again."""
+    def __init__(self, path=None, margin=3*24*60*60):
+        self.path = path or os.path.join(cache_dir, 'observations')
+        self.margin = margin
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._lock = threading.Lock()
+
+    def fname(self, provider, station, variable, datum):
+        key = '_'.join(str(part) for part in
+                       (provider, station, variable, datum))
+        key = ''.join(c if c.isalnum() or c in '-.' else '_' for c in key)
+        return os.path.join(self.path, key + '.nc')
+
+    def _load(self, fname):
+        """Times (s), values and coverage intervals (s) stored in `fname`."""
+        if not os.path.exists(fname):
+            return np.empty(0), np.empty(0), []
+        with Dataset(fname) as nc:
+            times = nc.variables['time'][:].astype(np.float64)
+            values = nc.variables['value'][:].astype(np.float64)
+            coverage = nc.variables['coverage'][:].tolist()
+        return (np.ma.filled(times, np.nan), np.ma.filled(values, np.nan),
+                [tuple(interval) for interval in coverage])
+
+    def coverage(self, provider, station, variable, datum):
+        """The (start, stop) datetimes already held."""
+        fname = self.fname(provider, station, variable, datum)
+        return [tuple(to_datetime(interval, unit='s')) for interval in
+                self._load(fname)[2]]
+
+    def missing(self, provider, station, variable, datum, start, stop):
+        """The (start, stop) datetimes of [start, stop] not held yet."""
+        coverage = self._load(self.fname(provider, station, variable,
+                                         datum))[2]
+        intervals = _subtract_intervals(_seconds(start), _seconds(stop),
+                                        coverage)
+        return [tuple(to_datetime(interval, unit='s')) for interval in
+                intervals]
+
+    def read(self, provider, station, variable, datum, start, stop):
+        """The Series of samples between `start` and `stop`."""
+        fname = self.fname(provider, station, variable, datum)
+        times, values, _ = self._load(fname)
+        keep = (times >= _seconds(start)) & (times <= _seconds(stop))
+        index = to_datetime(times[keep], unit='s')
+        index.name = 'date_time'
+        return Series(values[keep], index=index, name=variable)
+
+    def write(self, provider, station, variable, datum, series, start, stop):
+        """Merge `series`, the response for [start, stop], into the store.
+        New samples replace stored ones with the same time."""
+        fname = self.fname(provider, station, variable, datum)
+        start = _seconds(start)
+        stop = min(_seconds(stop), time.time() - self.margin)
+        with self._lock:
+            times, values, coverage = self._load(fname)
+            new = to_datetime(series.index).values.astype('datetime64[ns]')
+            new = new.astype(np.int64) / 1e9
+            keep = ~Series(times).isin(new).values
+            times = np.concatenate([times[keep], new])
+            values = np.concatenate([values[keep],
+                                     np.asarray(series, dtype=np.float64)])
+            order = np.argsort(times, kind='mergesort')
+            if start < stop:
+                coverage = _merge_intervals(coverage + [(start, stop)])
+            tmp = '{}.{}.tmp'.format(fname, os.getpid())
+            with Dataset(tmp, 'w') as nc:
+                nc.createDimension('time', None)
+                nc.createDimension('interval', None)
+                nc.createDimension('bounds', 2)
+                var = nc.createVariable('time', 'f8', ('time',))
+                var.units = 'seconds since 1970-01-01 00:00:00'
+                var[:] = times[order]
+                var = nc.createVariable('value', 'f8', ('time',),
+                                        fill_value=np.nan)
+                var.long_name = variable
+                var[:] = values[order]
+                var = nc.createVariable('coverage', 'f8',
+                                        ('interval', 'bounds'))
+                var.units = 'seconds since 1970-01-01 00:00:00'
+                if coverage:
+                    var[:] = np.array(coverage)
+                nc.setncatts(dict(provider=provider, station=str(station),
+                                  variable=variable, datum=str(datum)))
+            if os.path.exists(fname):  # Windows cannot rename over a file.
+                os.remove(fname)
+            os.rename(tmp, fname)
+
+    def observations(self, stations, start, stop, observed_property, column,
+                     datum='NAVD', provider='coops', fetch=None, **kw):
+        """Series of `column` for each of `stations` between `start` and
+        `stop`, downloading only what is missing from the store.
+
+        `fetch` is called as `fetch_observations` (the default) once per
+        missing interval, with the stations that miss it and the keywords
+        `kw`.  Returns {station: Series} and {station: exception} for the
+        stations that failed, like `fetch_observations`."""
+        fetch = fetch or fetch_observations
+        key = lambda station: (provider, station, observed_property, datum)
+        pending = dict()
+        for station in stations:
+            for interval in self.missing(*key(station) + (start, stop)):
+                pending.setdefault(interval, []).append(station)
+
+        errors = dict()
+        for (t0, t1), missing in pending.items():
+            data, failed = fetch(missing, t0, t1,
+                                 observed_property=observed_property,
+                                 datum=datum, columns=[column], **kw)
+            errors.update(failed)
+            for station, df in data.items():
+                self.write(*key(station) + (df[column], t0, t1))
+
+        data = dict()
+        for station in stations:
+            if station not in errors:
+                data[station] = self.read(*key(station) + (start, stop))
+                data[station].name = column
+        return data, errors
+
+
+class CachedVariable(object):
+    """A netCDF4 (OPeNDAP) `variable` read through a `ChunkCache`.
+
+    Indexing works as for the variable (slices and integers).  The chunks
+    under the requested window that are not in the cache are downloaded,
+    one request per box of contiguous missing chunks (see `_chunk_boxes`),
+    and stored; the window is then assembled from the chunks.
+
+    The chunk keys include the `version` of the variable (see
+    `ChunkCache.variable`), so chunks of an aggregation that has grown or
+    moved are not reused."""
+    def __init__(self, variable, url, name, cache, version=''):
+        self.variable = variable
+        self.url, self.name, self.cache = url, name, cache
+        self.version = version
+        self.shape = tuple(variable.shape)
+        self.dtype = _actual_dtype(variable)
+        self.ndim = len(self.shape)
+        self.chunks = cache.chunk_shape(self.ndim)
+
+    def _key(self, chunk):
+        return '{}|{}|{}|{}'.format(self.url, self.name, self.version,
+                                    ','.join(str(c) for c in chunk))
+
+    def _shape(self, chunk):
+        return tuple(b.stop - b.start for b in self._bounds(chunk))
+
+    def _bounds(self, chunk):
+        return tuple(slice(c * size, min((c + 1) * size, n))
+                     for c, size, n in zip(chunk, self.chunks, self.shape))
+
+    def __getitem__(self, keys):
+        if not isinstance(keys, tuple):
+            keys = (keys,)
+        if Ellipsis in keys:
+            k = keys.index(Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(keys) + 1)
+            keys = keys[:k] + fill + keys[k+1:]
+        keys = keys + (slice(None),) * (self.ndim - len(keys))
+        window, steps, squeeze = [], [], []
+        for dim, (key, n) in enumerate(zip(keys, self.shape)):
+            if isinstance(key, slice):
+                start, stop, step = key.indices(n)
+                if step < 0:
+                    return self.variable[keys]
+                window.append((start, max(start, stop)))
+                steps.append(slice(None, None, step))
+            elif isinstance(key, (int, np.integer)):
+                key = key + n if key < 0 else key
+                window.append((key, key + 1))
+                steps.append(0)
+                squeeze.append(dim)
+            else:  # Fancy indexing is not cached.
+                return self.variable[keys]
+        if any(start == stop for start, stop in window):
+            return self.variable[keys]
+
+        ranges = [range(start // size, (stop - 1) // size + 1)
+                  for (start, stop), size in zip(window, self.chunks)]
+        chunks = dict()
+        for chunk in itertools.product(*ranges):
+            content = self.cache.cache.get(self._key(chunk))
+            if content is not None:
+                part = _load_chunk(content)
+                if part.shape == self._shape(chunk):
+                    chunks[chunk] = part
+        missing = [chunk for chunk in itertools.product(*ranges)
+                   if chunk not in chunks]
+        for first, last in _chunk_boxes(missing):
+            slab = tuple(slice(b0.start, b1.stop) for b0, b1 in
+                         zip(self._bounds(first), self._bounds(last)))
+            data = self.variable[slab]
+            for chunk in itertools.product(*[range(c0, c1 + 1) for c0, c1
+                                             in zip(first, last)]):
+                part = data[tuple(slice(b.start - s.start, b.stop - s.start)
+                                  for b, s in zip(self._bounds(chunk),
+                                                  slab))]
+                self.cache.cache.set(self._key(chunk), _dump_chunk(part),
+                                     evict=False)
+                chunks[chunk] = part
+        if missing:
+            self.cache.cache.evict()
+
+        out = ma.masked_all([stop - start for start, stop in window],
+                            dtype=self.dtype)
+        for chunk, part in chunks.items():
+            inner, outer = [], []
+            for bound, (start, stop) in zip(self._bounds(chunk), window):
+                lo, hi = max(bound.start, start), min(bound.stop, stop)
+                inner.append(slice(lo - bound.start, hi - bound.start))
+                outer.append(slice(lo - start, hi - start))
+            out[tuple(outer)] = part[tuple(inner)]
+        return out[tuple(steps)]
+
+
+def _chunk_boxes(chunks):
+    """Merge the chunk indexes `chunks` into boxes of chunks, returned as
+    (first, last) chunk indexes.  Boxes that are adjacent along a dimension
+    and match along all the others are merged, one dimension after the
+    other, so the boxes cover exactly `chunks`."""
+    boxes = [(tuple(chunk), tuple(chunk)) for chunk in chunks]
+    ndim = len(boxes[0][0]) if boxes else 0
+    for dim in range(ndim):
+        def others(box):
+            return tuple(box[0][:dim] + box[0][dim+1:] +
+                         box[1][:dim] + box[1][dim+1:])
+        merged = []
+        for box in sorted(boxes, key=lambda box: (others(box), box[0][dim])):
+            if (merged and others(merged[-1]) == others(box) and
+                    merged[-1][1][dim] + 1 == box[0][dim]):
+                merged[-1] = (merged[-1][0], box[1])
+            else:
+                merged.append(box)
+        boxes = merged
+    return boxes
+
+
+def _actual_dtype(variable):
+    """The dtype of the values read from the netCDF4 `variable`, unpacked
+    with `scale_factor` and `add_offset` (as iris does)."""
+    dummy = np.zeros(1, dtype=variable.dtype)
+    attrs = variable.ncattrs()
+    if 'scale_factor' in attrs:
+        dummy = variable.getncattr('scale_factor') * dummy
+    if 'add_offset' in attrs:
+        dummy = variable.getncattr('add_offset') + dummy
+    return dummy.dtype
+
+
+def _dump_chunk(arr):
+    f = BytesIO()
+    np.savez_compressed(f, data=ma.getdata(arr), mask=ma.getmaskarray(arr))
+    return f.getvalue()
+
+
+def _load_chunk(content):
+    f = np.load(BytesIO(content))
+    return ma.array(f['data'], mask=f['mask'])
+
+
+class ChunkCache(object):
+    """Disk cache of the model data downloaded over OPeNDAP, stored as
+    compressed chunks keyed by dataset url, variable and chunk index (see
+    `DiskCache` for the expiration and the LRU eviction).
+
+    A later request is assembled from the chunks already downloaded plus
+    the missing ones, even when it only partially overlaps an earlier one.
+    Use `variable` in place of `netCDF4.Dataset(url).variables[name]`, or
+    pass the cache to `get_cube`."""
+    chunk_shapes = {1: (4096,), 2: (24, 4096), 3: (24, 64, 64),
+                    4: (24, 1, 64, 64)}
+
+    def __init__(self, ttl=24*60*60, max_bytes=2*1024**3, cache=None):
+        self.cache = cache or DiskCache('model_chunks', ttl=ttl,
+                                        max_bytes=max_bytes)
+
+    def chunk_shape(self, ndim):
+        return self.chunk_shapes.get(ndim, (1,) * (ndim - 2) + (64, 64))
+
+    @staticmethod
+    def version(nc, variable):
+        """The shape of `variable` and the first and last values of its
+        leading coordinate (e.g. time), which change when an aggregation
+        grows or moves."""
+        version = 'x'.join(str(n) for n in variable.shape)
+        dims = variable.dimensions
+        if dims and dims[0] in nc.variables:
+            coord = nc.variables[dims[0]]
+            if coord.ndim == 1 and len(coord):
+                version += '|{!r}|{!r}'.format(float(coord[0]),
+                                              float(coord[-1]))
+        return version
+
+    def variable(self, url, name):
+        nc = Dataset(url)
+        variable = nc.variables[name]
+        return CachedVariable(variable, url, name, self,
+                              version=self.version(nc, variable))
+
+    def cache_cube(self, cube, url):
+        """Read the lazy data of `cube` (loaded from `url`) through the
+        cache.  Returns False when the cube is not a single variable."""
+        if not cube.has_lazy_data() or not cube.var_name:
+            return False
+        try:
+            variable = self.variable(url, cube.var_name)
+        except (KeyError, RuntimeError, IOError):
+            return False
+        if variable.shape != cube.shape:
+            return False
+        cube.lazy_data(biggus.NumpyArrayAdapter(variable))
+        return True
+
+
+def _axis(var):
+    """Guess the CF axis (X, Y, Z or T) of the coordinate variable `var`."""
+    attrs = var.ncattrs()
+    axis = getattr(var, 'axis', '').upper() if 'axis' in attrs else ''
+    standard_name = getattr(var, 'standard_name', '')
+    units = getattr(var, 'units', '') if 'units' in attrs else ''
+    if axis in ('X', 'Y', 'Z', 'T'):
+        return axis
+    if standard_name == 'longitude' or units in ('degrees_east',
+                                                 'degree_east'):
+        return 'X'
+    if standard_name == 'latitude' or units in ('degrees_north',
+                                                'degree_north'):
+        return 'Y'
+    if standard_name == 'time' or ' since ' in units:
+        return 'T'
+    if 'positive' in attrs:
+        return 'Z'
+    return None
+
+
+class GridCache(object):
+    """Disk cache of the model grids: longitudes (wrapped to -180/180),
+    latitudes, depths, time axis, grid topology, the variable dimensions of
+    each axis and global attributes of the first variable of each dataset url
+    matching the `name_list`.  Used by `extract_model` to skip the models
+    without data in the period, to find the index window of the subset and to
+    build the KDTree of unstructured grids.
+
+    The horizontal grid is read only once.  A cached grid is revalidated with
+    the length of the time dimension (plus its last value): when the dataset
+    grows only the new time steps are downloaded."""
+    def __init__(self, ttl=30*24*60*60, max_bytes=1024**3, cache=None):
+        self.cache = cache or DiskCache('model_grids', ttl=ttl,
+                                        max_bytes=max_bytes)
+
+    @staticmethod
+    def _variable(nc, name_list):
+        for name, var in nc.variables.items():
+            if getattr(var, 'standard_name', None) in name_list:
+                return name, var
+        raise ValueError('Dataset does not contain {!r}'.format(name_list))
+
+    @staticmethod
+    def _coords(nc, var):
+        """The coordinate variables of `var` by axis."""
+        names = list(var.dimensions)
+        if 'coordinates' in var.ncattrs():
+            names.extend(var.coordinates.split())
+        coords = dict()
+        for name in names:
+            if name in nc.variables:
+                axis = _axis(nc.variables[name])
+                if axis and axis not in coords:
+                    coords[axis] = name
+        return coords
+
+    def _dump(self, key, grid):
+        arrays = dict((k, v) for k, v in grid.items()
+                      if isinstance(v, np.ndarray))
+        meta = dict((k, v) for k, v in grid.items() if k not in arrays)
+        f = BytesIO()
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+        self.cache.set(key, f.getvalue())
+
+    def _load(self, key):
+        content = self.cache.get(key)
+        if content is None:
+            return None
+        f = np.load(BytesIO(content))
+        grid = json.loads(str(f['meta']))
+        grid.update((k, f[k]) for k in f.files if k != 'meta')
+        return grid
+
+    def grid(self, url, name_list):
+        """Return the grid of the first variable at `url` matching
+        `name_list` as a dict."""
+        key = '{}|{}'.format(url, ','.join(sorted(name_list)))
+        nc = Dataset(url)
+        try:
+            name, var = self._variable(nc, name_list)
+            coords = self._coords(nc, var)
+            grid = self._load(key)
+            if grid is not None and grid['name'] == name and 'dims' in grid:
+                if 'T' not in coords:
+                    return grid
+                time = nc.variables[coords['T']]
+                ntime = len(grid['time'])
+                if (len(time) >= ntime > 0 and
+                        time[ntime-1] == grid['time'][-1]):
+                    if len(time) > ntime:  # Only the new time steps.
+                        grid['time'] = np.r_[grid['time'], time[ntime:]]
+                        self._dump(key, grid)
+                    return grid
+                grid['time'] = np.asarray(time[:])
+                grid['time_units'] = time.units
+                self._dump(key, grid)
+                return grid
+
+            if 'X' not in coords or 'Y' not in coords:
+                raise ValueError('Cannot find the longitude and latitude of '
+                                 '{!r} at {}'.format(name, url))
+            lon, lat = nc.variables[coords['X']], nc.variables[coords['Y']]
+            if lon.ndim == 1 and lat.ndim == 1:
+                if lon.dimensions == lat.dimensions:
+                    topology = 'unstructured'
+                else:
+                    topology = 'structured'
+            elif lon.ndim == 2 and lat.ndim == 2:
+                topology = 'curvilinear'
+            else:
+                raise CoordinateMultiDimError(
+                    'Cannot deal with X:{!r} and Y:{!r} dimensions'.format(
+                        lon.ndim, lat.ndim))
+            dims = dict()
+            for axis, coord in coords.items():
+                coord_dims = nc.variables[coord].dimensions
+                if all(dim in var.dimensions for dim in coord_dims):
+                    dims[axis] = [var.dimensions.index(dim)
+                                  for dim in coord_dims]
+            grid = dict(name=name, topology=topology,
+                        dimensions=list(var.dimensions),
+                        coords=coords, dims=dims,
+                        attributes=dict((k, str(nc.getncattr(k)))
+                                        for k in nc.ncattrs()),
+                        lon=wrap_lon180(np.asarray(lon[:], dtype=float)),
+                        lat=np.asarray(lat[:], dtype=float))
+            if 'Z' in coords:
+                grid['z'] = np.asarray(nc.variables[coords['Z']][:])
+            if 'T' in coords:
+                time = nc.variables[coords['T']]
+                grid['time'] = np.asarray(time[:])
+                grid['time_units'] = time.units
+                grid['calendar'] = getattr(time, 'calendar', 'standard')
+            self._dump(key, grid)
+            return grid
+        finally:
+            nc.close()
+
+    def covers(self, url, name_list, start, stop):
+        """Whether the model at `url` has any time step in [start, stop]."""
+        return grid_covers(self.grid(url, name_list), start, stop)
+
+
+def grid_covers(grid, start, stop):
+    """Whether the `grid` has any time step in [start, stop]."""
+    if 'time' not in grid:
+        return True
+    t0, t1 = date2num([start, stop], grid['time_units'],
+                      calendar=grid['calendar'])
+    time = grid['time']
+    return bool(((time >= t0) & (time <= t1)).any())
+
+
 # Misc.
 @contextlib.contextmanager
 def timeit(log=None):
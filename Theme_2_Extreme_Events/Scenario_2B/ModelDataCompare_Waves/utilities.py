@@ -7,13 +7,9 @@ way in the future...
 Standard Library.
 """
 
-from lxml import etree
+import os
+import sys
 from io import BytesIO
-from warnings import warn
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
 
 # Scientific stack.
 import numpy as np
@@ -24,6 +20,12 @@ from pandas import DataFrame, concat, read_csv
 from owslib import fes
 from owslib.ows import ExceptionReport
 
+# The station long names are shared with the other notebooks, see
+# station_names.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+
 
 def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
               constraint='overlaps'):
@@ -47,25 +49,8 @@ def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
 
 def get_station_longName(station):
     """Get longName for specific station using DescribeSensor
-    request."""
-
-    url = ('http://sdf.ndbc.noaa.gov/sos/server.php?service=SOS&'
-           'request=DescribeSensor&version=1.0.0&outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-           'procedure=urn:ioos:station:wmo:%s') % station
-    try:
-	    tree = etree.parse(urlopen(url))
-	    root = tree.getroot()
-	    namespaces = {'sml': "http://www.opengis.net/sensorML/1.0.1"}
-	    longName = root.xpath("//sml:identifier[@name='longName']/sml:Term/sml:value/text()", namespaces=namespaces)
-	    if len(longName) == 0:
-	    	# Just return the station id
-	        return station
-	    else:
-	        return longName[0]
-    except Exception as e:
-	    warn(e)
-	    # Just return the station id
-	    return station
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, 'ndbc')
 
 
 def collector2df(collector, station, sos_name):
@@ -2,14 +2,11 @@
 Utility functions for Scenario_A_Model_Obs_Compare_Winds.ipynb
 """
 
-from lxml import etree
+import os
+import sys
 from io import BytesIO
 from warnings import warn
 from IPython.display import HTML
-try:
-    from urllib.request import urlopen
-except ImportError:
-    from urllib import urlopen
 
 # Scientific stack.
 import numpy as np
@@ -19,6 +16,12 @@ from pandas import DataFrame, concat, read_csv
 from owslib import fes
 from owslib.ows import ExceptionReport
 
+# The station long names are shared with the other notebooks, see
+# station_names.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from station_names import StationNames  # noqa
+
 
 def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
                     constraint='overlaps'):
@@ -42,19 +45,8 @@ def fes_date_filter(start_date='1900-01-01', stop_date='2100-01-01',
 
 def get_Coops_longName(station):
     """Get longName for specific station from COOPS SOS using DescribeSensor
-    request."""
-    url = ('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS?service=SOS&'
-           'request=DescribeSensor&version=1.0.0&'
-           'outputFormat=text/xml;subtype="sensorML/1.0.1"&'
-           'procedure=urn:ioos:station:NOAA.NOS.CO-OPS:%s') % station
-    tree = etree.parse(urlopen(url))
-    root = tree.getroot()
-    path = "//sml:identifier[@name='longName']/sml:Term/sml:value/text()"
-    namespaces = dict(sml="http://www.opengis.net/sensorML/1.0.1")
-    longName = root.xpath(path, namespaces=namespaces)
-    if len(longName) == 0:
-        longName = station
-    return longName[0]
+    request.  See `StationNames` in station_names.py."""
+    return StationNames.shared().get(station, 'coops')
 
 
 def coops2df(collector, coops_id, sos_name):
@@ -3,7 +3,7 @@
 
 # <codecell>
 
-from utilities import css_styles
+from utilities import css_styles, EndpointRegistry, CapabilitiesCache
 css_styles()
 
 # <markdowncell>
@@ -129,7 +129,6 @@ print etree.tostring(filters.toXML(), pretty_print=True)
 
 # <codecell>
 
-from owslib.csw import CatalogueServiceWeb
 endpoints = ['http://www.nodc.noaa.gov/geoportal/csw',
              'http://www.ngdc.noaa.gov/geoportal/csw',
              'http://catalog.data.gov/csw-all',
@@ -147,29 +146,56 @@ endpoints = ['http://www.nodc.noaa.gov/geoportal/csw',
 
 # <codecell>
 
+# The capabilities and health of each endpoint are remembered between runs:
+# endpoints are only probed once, and the ones that keep failing are skipped
+# for an hour (and re-probed in the background after that).
+registry = EndpointRegistry()
+registry.reprobe()
+# GetCapabilities documents, parsed once and shared by the probe and the query.
+capabilities = CapabilitiesCache()
+
 bbox_endpoints = []
 for url in endpoints:
-    queryables = []
+    if not registry.available(url):
+        print "Skipped - %s - %s" % (url, registry.entry(url)['last_error'])
+        continue
     try:
-        csw = CatalogueServiceWeb(url, timeout=20)
-    except BaseException:
-        print "Failure - %s - Timed out" % url
-    if "BBOX" in csw.filters.spatial_operators:
-        print "Success - %s - BBOX Query supported" % url
-        bbox_endpoints.append(url)    
-    else:
-        print "Failure - %s - BBOX Query NOT supported" % url
+        if 'spatial_operators' not in registry.capabilities(url):
+            try:
+                registry.probe(url, timeout=20, cache=capabilities)
+            except BaseException:
+                print "Failure - %s - Timed out" % url
+                continue
+        if "BBOX" in registry.capabilities(url)['spatial_operators']:
+            print "Success - %s - BBOX Query supported" % url
+            bbox_endpoints.append(url)
+        else:
+            print "Failure - %s - BBOX Query NOT supported" % url
+    finally:
+        # Only the endpoints queried below record an outcome, the others give
+        # back the retry slot `available` may have given them.
+        if url not in bbox_endpoints:
+            registry.release(url)
+registry.save()
 
 # <codecell>
 
+import time
+
 dap_urls = []
 dap_services = ["urn:x-esri:specification:ServiceType:odp:url",
                 "urn:x-esri:specification:ServiceType:OPeNDAP"]
-for url in bbox_endpoints:
-    print "*", url
+for endpoint in bbox_endpoints:
+    print "*", endpoint
     try:
-        csw = CatalogueServiceWeb(url, timeout=20)
-        csw.getrecords2(constraints=[filters], maxrecords=1000, esn='full')
+        t0 = time.time()
+        try:
+            csw = capabilities.client(endpoint, timeout=20)
+            csw.getrecords2(constraints=[filters], maxrecords=1000, esn='full')
+        except BaseException as e:
+            registry.record(endpoint, time.time() - t0, e)
+            raise
+        registry.record(endpoint, time.time() - t0)
         for record, item in csw.records.items():
             print "  -", item.title
             # Get DAP URLs
@@ -180,7 +206,8 @@ for url in bbox_endpoints:
             else:
                 print "    + No OPeNDAP service available"
     except BaseException as e:
-        print "  - FAILED", url, e.msg
+        print "  - FAILED", endpoint, e
+registry.save()
 
 # <markdowncell>
 
@@ -1,3 +1,13 @@
+import os
+import sys
+
+# The endpoint registry and the capabilities cache are shared with the other
+# notebooks, see csw_endpoints.py at the top of the repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from csw_endpoints import EndpointRegistry, CapabilitiesCache  # noqa
+
+
 def service_urls(records, service='odp:url'):
     """Extract service_urls of a specific type (DAP, SOS) from records."""
     service_string = 'urn:x-esri:specification:ServiceType:' + service
@@ -0,0 +1,356 @@
+"""
+Health and capabilities of the CSW endpoints, shared by the notebooks.
+
+The notebooks import it through their `utilities.py`, which adds the top of
+the repository to `sys.path`.
+"""
+
+import os
+import copy
+import json
+import time
+import hashlib
+import warnings
+import threading
+from io import BytesIO
+try:
+    from urlparse import parse_qs
+except ImportError:  # py3k
+    from urllib.parse import parse_qs
+
+import pandas as pd
+import requests
+from owslib.etree import etree
+try:
+    from owslib.catalogue.csw2 import CatalogueServiceWeb
+except ImportError:
+    from owslib.csw import CatalogueServiceWeb
+
+
+class _CapabilitiesCSW(CatalogueServiceWeb):
+    """`CatalogueServiceWeb` built from an already downloaded GetCapabilities
+    document.
+
+    OWSLib finds the URL of an operation from the name of the method calling
+    `_invoke`, which is this override, so it is resolved here instead."""
+    def __init__(self, url, capabilities, **kw):
+        self._capabilities = capabilities
+        CatalogueServiceWeb.__init__(self, url, **kw)
+
+    def operation_url(self, name, method):
+        """The URL advertised for operation `name` and HTTP `method`."""
+        for operation in getattr(self, 'operations', None) or []:
+            if operation.name != name:
+                continue
+            for verb in operation.methods:
+                if verb.get('type', '').lower() == method.lower():
+                    return verb.get('url')
+        return None
+
+    def _invoke(self):
+        if self._capabilities is not None:
+            self._exml = etree.parse(BytesIO(self._capabilities))
+            self._capabilities = None
+            return
+        if hasattr(self.request, 'tag'):  # POST XML.
+            name, method = self.request.tag.split('}')[-1], 'Post'
+        else:  # GET KVP.
+            params = parse_qs(self.request.split('?')[-1])
+            name, method = params.get('request', [None])[0], 'Get'
+        url = self.url
+        self.url = self.operation_url(name, method) or url
+        try:
+            CatalogueServiceWeb._invoke(self)
+        finally:
+            self.url = url
+
+
+class CapabilitiesCache(object):
+    """GetCapabilities of CSW endpoints, parsed in memory and raw on disk.
+
+    `client(url)` returns a copy of the parsed `CatalogueServiceWeb`, so only
+    the first client for an endpoint costs a request.  The documents stored
+    on disk are trusted for `ttl` seconds, and after that revalidated with
+    their ETag/Last-Modified (a 304 answer re-uses the stored document).
+    When the endpoint cannot be reached the stored document is used, with a
+    warning."""
+    def __init__(self, path=None, ttl=24*60*60):
+        self.path = path or os.path.join(os.path.expanduser('~'), '.cache',
+                                         'ioos_system_test', 'capabilities')
+        self.ttl = ttl
+        self.clients = dict()
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _fetch(self, url, timeout):
+        """Return the GetCapabilities document of `url` and the headers to
+        store with it (None when the copy on disk is still fresh)."""
+        fname = os.path.join(self.path,
+                             hashlib.sha1(url.encode('utf-8')).hexdigest())
+        info, xml = dict(), None
+        if os.path.exists(fname + '.json') and os.path.exists(fname + '.xml'):
+            with open(fname + '.json') as f:
+                info = json.load(f)
+            with open(fname + '.xml', 'rb') as f:
+                xml = f.read()
+            if time.time() - info['checked'] < self.ttl:
+                return xml, None
+        headers = dict()
+        if info.get('etag'):
+            headers['If-None-Match'] = info['etag']
+        if info.get('last_modified'):
+            headers['If-Modified-Since'] = info['last_modified']
+        params = dict(service='CSW', version='2.0.2',
+                      request='GetCapabilities')
+        try:
+            r = requests.get(url, params=params, headers=headers,
+                             timeout=timeout)
+            if r.status_code != 304 or xml is None:
+                r.raise_for_status()
+                xml, info = r.content, dict(
+                    etag=r.headers.get('ETag'),
+                    last_modified=r.headers.get('Last-Modified'))
+        except requests.RequestException as e:
+            if xml is None:
+                raise
+            warnings.warn('{} is unreachable ({}), using the stale '
+                          'capabilities.'.format(url, e))
+            return xml, None
+        info['checked'] = time.time()
+        return xml, info
+
+    def _store(self, url, xml, info):
+        fname = os.path.join(self.path,
+                             hashlib.sha1(url.encode('utf-8')).hexdigest())
+        for ext, data, mode in [('.xml', xml, 'wb'),
+                                ('.json', json.dumps(info), 'w')]:
+            tmp = '{}{}.{}.tmp'.format(fname, ext, os.getpid())
+            with open(tmp, mode) as f:
+                f.write(data)
+            if os.path.exists(fname + ext):
+                os.remove(fname + ext)
+            os.rename(tmp, fname + ext)
+
+    def client(self, url, timeout=10):
+        """A `CatalogueServiceWeb` for `url`."""
+        with self.lock:
+            csw = self.clients.get(url)
+        if csw is None:
+            xml, info = self._fetch(url, timeout)
+            csw = _CapabilitiesCSW(url, xml, timeout=timeout)
+            if csw.exceptionreport is not None:
+                raise ValueError('GetCapabilities of {} failed: {}'.format(
+                    url, csw.exceptionreport.exceptions))
+            if info is not None:
+                self._store(url, xml, info)
+            with self.lock:
+                csw = self.clients.setdefault(url, csw)
+        csw = copy.copy(csw)
+        csw.timeout = timeout
+        return csw
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+        for fname in os.listdir(self.path):
+            os.remove(os.path.join(self.path, fname))
+
+
+class EndpointRegistry(object):
+    """Health and capabilities of CSW endpoints, kept between runs in a JSON
+    file shared by all the notebooks.
+
+    Every request outcome is recorded with `record`: latency (moving
+    average), success rate and consecutive failures.  After `max_failures`
+    failures in a row the circuit opens and `available` is False for
+    `cooldown` seconds.  Then the circuit is half-open: `available` lets a
+    single request through, whose success closes the circuit and whose
+    failure opens it again.  A caller that gets True but makes no request
+    must `release` the slot (otherwise it is only given again after
+    `cooldown`).
+    `reprobe` retries the open endpoints in a background thread.  `probe`
+    also stores the capabilities we query, like the supported spatial
+    operators, so they are not downloaded on every run.
+
+    `save` merges with the file, so notebooks sharing it do not lose each
+    other's counts."""
+    def __init__(self, fname=None, max_failures=3, cooldown=60*60):
+        if fname is None:
+            fname = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'ioos_system_test', 'csw_endpoints.json')
+        self.fname = fname
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.lock = threading.RLock()
+        self._reprobing = threading.Lock()
+        self._thread = None
+        self.endpoints = self._read()
+        self._saved = copy.deepcopy(self.endpoints)
+
+    def _read(self):
+        if not os.path.exists(self.fname):
+            return dict()
+        with open(self.fname) as f:
+            return json.load(f)
+
+    def entry(self, url):
+        with self.lock:
+            return self.endpoints.setdefault(url, dict(successes=0,
+                                                       failures=0,
+                                                       consecutive_failures=0,
+                                                       latency=None,
+                                                       last_failure=None,
+                                                       last_error=None,
+                                                       half_open=None,
+                                                       updated=None,
+                                                       capabilities=dict()))
+
+    def state(self, url):
+        """'closed', 'open' or 'half-open' (the trial request is out)."""
+        entry = self.entry(url)
+        if entry['consecutive_failures'] < self.max_failures:
+            return 'closed'
+        now = time.time()
+        if now - entry['last_failure'] <= self.cooldown:
+            return 'open'
+        if (entry.get('half_open') is not None and
+                now - entry['half_open'] <= self.cooldown):
+            return 'half-open'
+        return 'due'
+
+    def available(self, url):
+        """False while the circuit of `url` is open.  When it is due for a
+        retry only the first caller gets True."""
+        with self.lock:
+            state = self.state(url)
+            if state == 'due':
+                self.entry(url)['half_open'] = time.time()
+                return True
+            return state == 'closed'
+
+    def release(self, url):
+        """Give back the half-open slot taken by `available` when no request
+        was made to `url` after all, so the next caller can retry it."""
+        with self.lock:
+            self.entry(url)['half_open'] = None
+
+    def record(self, url, elapsed, error=None):
+        """Record the outcome of one request to `url`."""
+        with self.lock:
+            entry = self.entry(url)
+            entry['half_open'] = None
+            entry['updated'] = time.time()
+            if error is None:
+                entry['successes'] += 1
+                entry['consecutive_failures'] = 0
+                if entry['latency'] is None:
+                    entry['latency'] = elapsed
+                else:
+                    entry['latency'] = 0.8 * entry['latency'] + 0.2 * elapsed
+            else:
+                entry['failures'] += 1
+                entry['consecutive_failures'] += 1
+                entry['last_failure'] = time.time()
+                entry['last_error'] = str(error)
+
+    def success_rate(self, url):
+        entry = self.entry(url)
+        total = entry['successes'] + entry['failures']
+        return float(entry['successes']) / total if total else None
+
+    def capabilities(self, url):
+        return self.entry(url)['capabilities']
+
+    def probe(self, url, timeout=20, cache=None):
+        """Construct a `CatalogueServiceWeb` for `url` recording the outcome
+        and the capabilities.  Returns the instance.
+
+        With a `CapabilitiesCache` the GetCapabilities document is only
+        downloaded when the cached one is out of date."""
+        t0 = time.time()
+        try:
+            if cache is None:
+                csw = CatalogueServiceWeb(url, timeout=timeout)
+            else:
+                csw = cache.client(url, timeout=timeout)
+        except Exception as e:
+            self.record(url, time.time() - t0, e)
+            raise
+        self.record(url, time.time() - t0)
+        filters = getattr(csw, 'filters', None)
+        operations = getattr(csw, 'operations', None) or []
+        with self.lock:
+            self.capabilities(url).update(
+                version=csw.version,
+                operations=[op.name for op in operations],
+                spatial_operators=list(getattr(filters, 'spatial_operators',
+                                               None) or []))
+        return csw
+
+    def reprobe(self, timeout=20):
+        """Probe, in a background thread, the endpoints whose circuit is due
+        for a retry.  Each takes the half-open slot, so the foreground loop
+        skips it meanwhile.  Only one reprobe runs at a time: returns its
+        thread."""
+        if not self._reprobing.acquire(False):
+            return self._thread
+
+        def run():
+            try:
+                for url in list(self.endpoints):
+                    if (self.state(url) == 'due' and self.available(url)):
+                        try:
+                            self.probe(url, timeout=timeout)
+                        except Exception:
+                            pass
+                self.save()
+            finally:
+                self._reprobing.release()
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def _merge(self, url, ours, theirs):
+        """Entry of `url` with our changes since the last save applied over
+        the one in the file."""
+        saved = self._saved.get(url, dict())
+        newer = (ours.get('updated') or 0) >= (theirs.get('updated') or 0)
+        merged = dict(ours if newer else theirs)
+        for key in ('successes', 'failures'):
+            merged[key] = theirs[key] + ours[key] - saved.get(key, 0)
+        merged['capabilities'] = dict(theirs.get('capabilities') or {},
+                                      **ours['capabilities'])
+        return merged
+
+    def save(self):
+        with self.lock:
+            path = os.path.dirname(self.fname)
+            if path and not os.path.isdir(path):
+                os.makedirs(path)
+            endpoints = self._read()
+            for url, entry in self.endpoints.items():
+                if url in endpoints:
+                    entry = self._merge(url, entry, endpoints[url])
+                endpoints[url] = entry
+            tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(endpoints, f, indent=2, sort_keys=True)
+            if os.path.exists(self.fname):
+                os.remove(self.fname)
+            os.rename(tmp, self.fname)
+            self.endpoints = endpoints
+            self._saved = copy.deepcopy(endpoints)
+
+    def summary(self):
+        """The registry as a DataFrame, one row per endpoint."""
+        rows = dict()
+        with self.lock:
+            for url, entry in self.endpoints.items():
+                row = dict((key, value) for key, value in entry.items()
+                           if key != 'capabilities')
+                row['success_rate'] = self.success_rate(url)
+                row['available'] = self.state(url) in ('closed', 'due')
+                rows[url] = row
+        return pd.DataFrame.from_dict(rows, orient='index')
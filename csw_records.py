@@ -0,0 +1,76 @@
+"""
+Helpers for the records returned by the CSW catalogs, shared by the
+notebooks.
+
+The notebooks import it through their `utilities.py`, which adds the top of
+the repository to `sys.path`.
+"""
+
+service_mapping = {
+    "odp": "opendap"
+}
+
+
+def normalize_service_urn(urn):
+    urns = urn.split(':')
+    if urns[-1].lower() == "url":
+        del urns[-1]
+    if urns[-1] in service_mapping:
+        return service_mapping[urns[-1]]
+    return urns[-1].lower()
+
+
+class ServiceIndex(object):
+    """Service URLs from CSW records indexed by service type.
+
+    The references of each record are scanned once and filed under
+    `normalize_service_urn(scheme)`, so aliases like 'OPeNDAP' and 'odp:url'
+    end up together.  Any alias works when querying, e.g.
+    `ServiceIndex(csw.records).urls('odp:url')`."""
+    def __init__(self, records=None):
+        self.index = dict()
+        if records is not None:
+            self.add(records)
+
+    def add(self, records):
+        """Index a `csw.records` or a page of them."""
+        for rec in records.values():
+            for reference in rec.references:
+                scheme, url = reference.get('scheme'), reference.get('url')
+                if scheme and url:
+                    service = normalize_service_urn(scheme)
+                    self.index.setdefault(service, set()).add(url)
+        return self
+
+    def urls(self, service):
+        """Sorted unique URLs of `service`."""
+        return sorted(self.index.get(normalize_service_urn(service), []))
+
+    @property
+    def services(self):
+        return sorted(self.index)
+
+    def counts(self):
+        """Number of unique URLs per service."""
+        return dict((service, len(urls)) for service, urls in
+                    self.index.items())
+
+
+def iter_pages(csw, constraints, pagesize=100, **kw):
+    """Page through all the records matching `constraints` following the
+    `nextRecord` of each GetRecords response.  Yields `csw.records` for each
+    page, so only `pagesize` records are held in memory at a time and there
+    is no `maxrecords` cap on the total.  Keywords are passed to
+    `csw.getrecords2`."""
+    startposition = 1
+    while True:
+        csw.getrecords2(constraints=constraints, startposition=startposition,
+                        maxrecords=pagesize, **kw)
+        records, csw.records = csw.records, None
+        yield records
+        results = csw.results
+        nextrecord = results.get('nextrecord') or 0
+        if (not results.get('returned') or nextrecord <= startposition or
+                nextrecord > results.get('matches', 0)):
+            break
+        startposition = nextrecord
@@ -0,0 +1,60 @@
+"""
+Split long time series requests into windows and fetch them concurrently,
+shared by the notebooks.
+
+The notebooks import it through their `utilities.py`, which adds the top of
+the repository to `sys.path`.
+"""
+
+import time
+import datetime as dt
+from warnings import warn
+from multiprocessing.pool import ThreadPool
+
+from owslib.ows import ExceptionReport
+
+
+def time_windows(start, stop, period='month'):
+    """Split [start, stop] into calendar `period` ('month' or 'year')
+    windows, e.g. to stay under the longest period a service returns per
+    request."""
+    windows = []
+    t0 = start
+    while t0 <= stop:
+        if period == 'year':
+            t1 = dt.datetime(t0.year + 1, 1, 1)
+        else:
+            t1 = dt.datetime(t0.year + t0.month // 12, t0.month % 12 + 1, 1)
+        windows.append((t0, min(t1 - dt.timedelta(seconds=1), stop)))
+        t0 = t1
+    return windows
+
+
+def fetch_windows(fetch, windows, workers=4, retries=3, wait=2):
+    """Call `fetch(start, stop)` for each of the `windows`, `workers` at a
+    time, retrying failed requests `retries` times with an exponential
+    backoff.  An `ExceptionReport` (e.g. no data in that window) is not
+    retried.  Returns the results in the order of `windows`, None for the
+    windows that failed."""
+    def attempt(window):
+        error = None
+        for k in range(retries):
+            try:
+                return fetch(*window)
+            except ExceptionReport as e:
+                error = e
+                break
+            except Exception as e:
+                error = e
+                if k < retries - 1:
+                    time.sleep(wait * 2 ** k)
+        warn('{} to {} failed: {}'.format(window[0], window[1], error))
+        return None
+
+    if not windows:
+        return []
+    pool = ThreadPool(min(workers, len(windows)))
+    try:
+        return pool.map(attempt, windows)
+    finally:
+        pool.close()
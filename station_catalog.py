@@ -0,0 +1,159 @@
+"""
+Catalog of the SOS stations in a bounding box, shared by the notebooks.
+
+The notebooks import it through their `utilities.py`, which adds the top of
+the repository to `sys.path`.
+"""
+
+from warnings import warn
+from multiprocessing.pool import ThreadPool
+try:
+    from urllib import urlencode
+except ImportError:  # py3k
+    from urllib.parse import urlencode
+
+import numpy as np
+from pandas import DataFrame, concat, read_csv
+
+
+def latest_observations(network, bbox, observed_property, **params):
+    """CSV GetObservation of the latest observation of all the stations of
+    `network` (url, offering) in `bbox` [lon_min, lat_min, lon_max, lat_max].
+    `params` are added to the request."""
+    url, offering = network
+    params.update(service='SOS', request='GetObservation', version='1.0.0',
+                  offering=offering, observedProperty=observed_property,
+                  featureOfInterest='BBOX:' + ','.join(str(e) for e in bbox),
+                  responseFormat='text/csv')
+    obs_loc_df = read_csv('{}?{}'.format(url, urlencode(params)))
+    if 'station_id' not in obs_loc_df.columns:
+        raise ValueError('No stations in the {} response.'.format(offering))
+    return obs_loc_df
+
+
+def station_table(obs_loc_df, provider):
+    """One row per station of a multi station SOS CSV with the station_id,
+    provider, lon, lat and sensors (comma separated sensor ids)."""
+    df = obs_loc_df.reset_index()
+    grouped = df.groupby('station_id', sort=False)
+    table = DataFrame(dict(
+        lon=grouped['longitude (degree)'].first().astype(np.float64),
+        lat=grouped['latitude (degree)'].first().astype(np.float64)))
+    if 'sensor_id' in df.columns:
+        table['sensors'] = grouped['sensor_id'].apply(
+            lambda s: ','.join(str(sensor) for sensor in s.unique()))
+    else:
+        table['sensors'] = ''
+    table['provider'] = provider
+    table.index.name = 'station_id'
+    return table.reset_index()[StationCatalog.columns]
+
+
+def haversine(lon0, lat0, lon, lat, radius=6371.0):
+    """Great circle distance (km) from (lon0, lat0) to the (lon, lat)
+    arrays."""
+    lon0, lat0, lon, lat = map(np.deg2rad, (lon0, lat0, lon, lat))
+    a = (np.sin((lat - lat0) / 2) ** 2 +
+         np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2)
+    return 2 * radius * np.arcsin(np.sqrt(a))
+
+
+class StationCatalog(object):
+    """Table of the stations of several SOS providers, one row per
+    station_id, with a spatial index for `within` (bounding box) and `near`
+    (point) queries.
+
+    `fetch` lists the stations of all the providers concurrently.  A station
+    served by more than one provider is kept from the first one."""
+    columns = ['station_id', 'provider', 'lon', 'lat', 'sensors']
+
+    def __init__(self, table=None):
+        self.stations = DataFrame(columns=self.columns)
+        self._lon = np.empty(0)
+        if table is not None:
+            self.add(table)
+
+    @classmethod
+    def fetch(cls, bbox, observed_property, networks,
+              providers=('coops', 'ndbc'), params=None):
+        """The stations of `providers` in `bbox`.  `networks` maps a provider
+        to the (url, offering) to request, and `params` to extra request
+        parameters."""
+        params = params or dict()
+
+        def latest(provider):
+            try:
+                obs_loc_df = latest_observations(networks[provider], bbox,
+                                                 observed_property,
+                                                 **params.get(provider, {}))
+                return station_table(obs_loc_df, provider), None
+            except Exception as e:
+                return None, e
+
+        pool = ThreadPool(len(providers))
+        try:
+            results = pool.map(latest, providers)
+        finally:
+            pool.close()
+        catalog = cls()
+        for provider, (table, error) in zip(providers, results):
+            if error is None:
+                catalog.add(table)
+            else:
+                warn('Could not list the {} stations: {}'.format(provider,
+                                                                 error))
+        return catalog
+
+    def add(self, table):
+        """Merge a `station_table`.  The stations are kept sorted by
+        longitude, which is the index `within` and `near` search."""
+        stations = concat([self.stations, table[self.columns]],
+                          ignore_index=True)
+        stations = stations.drop_duplicates('station_id')
+        lon = stations['lon'].values.astype(np.float64)
+        order = np.argsort(lon, kind='mergesort')
+        self.stations = stations.iloc[order].reset_index(drop=True)
+        self._lon = lon[order]
+
+    def __len__(self):
+        return len(self.stations)
+
+    def within(self, bbox):
+        """The stations in `bbox` [lon_min, lat_min, lon_max, lat_max]."""
+        lon_min, lat_min, lon_max, lat_max = bbox
+        start = np.searchsorted(self._lon, lon_min, side='left')
+        stop = np.searchsorted(self._lon, lon_max, side='right')
+        stations = self.stations.iloc[start:stop]
+        lat = stations['lat'].values.astype(np.float64)
+        return stations[(lat >= lat_min) & (lat <= lat_max)]
+
+    def near(self, lon, lat, radius=None, k=None):
+        """The stations within `radius` km of (lon, lat) and/or the `k`
+        nearest ones, closest first, with their 'distance (km)'."""
+        if radius is None:
+            stations = self.stations
+        else:
+            dlat = radius / 111.2
+            dlon = dlat / max(np.cos(np.deg2rad(lat)), 1e-6)
+            stations = self.within([lon - dlon, lat - dlat,
+                                    lon + dlon, lat + dlat])
+        distance = haversine(lon, lat,
+                             stations['lon'].values.astype(np.float64),
+                             stations['lat'].values.astype(np.float64))
+        stations = stations.copy()
+        stations['distance (km)'] = distance
+        order = np.argsort(distance, kind='mergesort')
+        if radius is not None:
+            order = order[distance[order] <= radius]
+        if k is not None:
+            order = order[:k]
+        return stations.iloc[order]
+
+    def st_list(self):
+        """The stations as the {station_id: {'lat', 'lon', 'source'}} dict
+        used by the notebooks."""
+        stations = self.stations
+        return dict((station, dict(lat=lat, lon=lon, source=provider))
+                    for station, lat, lon, provider in
+                    zip(stations['station_id'], stations['lat'],
+                        stations['lon'], stations['provider']))
@@ -0,0 +1,144 @@
+"""
+Long names of the CO-OPS and NDBC stations, shared by the notebooks.
+
+The notebooks import it through their `utilities.py`, which adds the top of
+the repository to `sys.path`.
+"""
+
+import os
+import json
+import time
+import threading
+from warnings import warn
+from multiprocessing.pool import ThreadPool
+
+import requests
+from lxml import etree
+
+
+class StationNames(object):
+    """Long names of the CO-OPS and NDBC stations, from their SOS
+    DescribeSensor.
+
+    Each station is requested once: the names are kept in memory and in a
+    JSON file for `ttl` seconds, and `fetch` resolves the missing names of
+    a list of stations with `workers` concurrent requests.  If a request
+    fails the expired cached name, or the station id, is returned instead,
+    but not kept: the next call requests it again.
+    `get` is called as `requests.get` for the DescribeSensor requests."""
+    describe_sensor = dict(
+        coops=('http://opendap.co-ops.nos.noaa.gov/ioos-dif-sos/SOS',
+               'urn:ioos:station:NOAA.NOS.CO-OPS:{}'),
+        ndbc=('http://sdf.ndbc.noaa.gov/sos/server.php',
+              'urn:ioos:station:wmo:{}'))
+    _shared = None
+
+    def __init__(self, ttl=30*24*60*60, workers=8, fname=None, get=None):
+        if fname is None:
+            fname = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'ioos_system_test', 'station_names.json')
+        self.fname = fname
+        self.ttl = ttl
+        self.workers = workers
+        self.get_url = get or requests.get
+        self.lock = threading.Lock()
+        self.names = dict()
+
+    @classmethod
+    def shared(cls, **kw):
+        """The instance used by the `get_*_longName` helpers.  The keywords
+        are used when it is created."""
+        if cls._shared is None:
+            cls._shared = cls(**kw)
+        return cls._shared
+
+    def _read(self):
+        """{key: (name, time stored)} from the file."""
+        try:
+            with open(self.fname) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def _write(self, names):
+        """Merge `names` into the file."""
+        with self.lock:
+            stored = self._read()
+            stored.update(names)
+            path = os.path.dirname(self.fname)
+            if path and not os.path.isdir(path):
+                os.makedirs(path)
+            tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(stored, f, indent=0, sort_keys=True)
+            if os.path.exists(self.fname):  # Windows cannot rename over it.
+                os.remove(self.fname)
+            os.rename(tmp, self.fname)
+
+    def describe(self, station, provider='coops'):
+        """Request the longName of `station`."""
+        url, procedure = self.describe_sensor[provider]
+        params = dict(service='SOS', request='DescribeSensor',
+                      version='1.0.0',
+                      outputFormat='text/xml;subtype="sensorML/1.0.1"',
+                      procedure=procedure.format(station))
+        r = self.get_url(url, params=params, timeout=60)
+        r.raise_for_status()
+        root = etree.fromstring(r.content)
+        path = "//sml:identifier[@name='longName']/sml:Term/sml:value/text()"
+        namespaces = dict(sml="http://www.opengis.net/sensorML/1.0.1")
+        longName = root.xpath(path, namespaces=namespaces)
+        if len(longName) == 0:
+            return station
+        return longName[0]
+
+    def fetch(self, stations, provider='coops'):
+        """Return {station: long name} for `stations`."""
+        provider = provider.lower()
+        stations = [str(station) for station in stations]
+        stored = None
+        missing, fallback = [], dict()
+        for station in set(stations):
+            key = '{}:{}'.format(provider, station)
+            if key in self.names:
+                continue
+            if stored is None:
+                stored = self._read()
+            name, stamp = stored.get(key, (None, 0))
+            if name is None or time.time() - stamp > self.ttl:
+                missing.append(station)
+            else:
+                self.names[key] = name
+
+        def describe(station):
+            try:
+                return station, self.describe(station, provider), None
+            except Exception as e:
+                return station, None, e
+
+        if missing:
+            pool = ThreadPool(min(self.workers, len(missing)))
+            try:
+                results = pool.map(describe, missing)
+            finally:
+                pool.close()
+            fetched = dict()
+            for station, name, error in results:
+                key = '{}:{}'.format(provider, station)
+                if error is None:
+                    fetched[key] = (name, time.time())
+                    self.names[key] = name
+                else:
+                    warn('DescribeSensor for {} failed: {}'.format(station,
+                                                                   error))
+                    fallback[station] = stored.get(key, (station, 0))[0]
+            if fetched:
+                self._write(fetched)
+        names = dict(fallback)
+        for station in stations:
+            if station not in names:
+                names[station] = self.names['{}:{}'.format(provider, station)]
+        return names
+
+    def get(self, station, provider='coops'):
+        return self.fetch([station], provider)[str(station)]